@@ -0,0 +1,83 @@
+import asyncio
+import time
+from dunebugger_logging import logger
+from request_tracker import LatencyStats
+
+EXIT_COMMANDS = ["exit", "quit", "q"]
+
+
+def split_commands(line):
+    """Split a ';'-separated input line into commands, skipping blanks and # comments."""
+    if line.lstrip().startswith("#"):
+        return []
+    return [cmd.strip() for cmd in line.split(";") if cmd.strip()]
+
+
+class BatchRunner:
+    """Streams commands from a file and dispatches them with a bounded in-flight window.
+
+    Up to window commands wait for their reply at the same time. When the input is
+    exhausted and every reply arrived (or timed out) a throughput and latency summary is printed.
+    """
+
+    def __init__(self, mqueue_handler, window=8, recipient="core"):
+        self.mqueue_handler = mqueue_handler
+        self.window = window
+        self.recipient = recipient
+        self.latency = LatencyStats(window=100000)
+        self.results = {"ok": 0, "failed": 0, "no reply": 0}
+
+    async def run(self, stream):
+        """Run all commands read from stream. Returns True if every command succeeded."""
+        loop = asyncio.get_running_loop()
+        window = asyncio.Semaphore(self.window)
+        tasks = set()
+        started_at = time.perf_counter()
+
+        reading = True
+        while reading:
+            line = await loop.run_in_executor(None, stream.readline)
+            if not line:
+                break
+            for command in split_commands(line):
+                if command.lower() in EXIT_COMMANDS:
+                    reading = False
+                    break
+                await window.acquire()
+                task = asyncio.create_task(self._run_command(command, window))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        print(self.summary(time.perf_counter() - started_at))
+        return self.results["failed"] == 0 and self.results["no reply"] == 0
+
+    async def _run_command(self, command, window):
+        try:
+            future = await self.mqueue_handler.dispatch_message(command, "terminal_command", self.recipient)
+            reply = await future
+            if reply is None:
+                self.results["no reply"] += 1
+                return
+            self.latency.add(reply["latency"])
+            body = reply["body"]
+            if isinstance(body, dict) and body.get("success") is False:
+                self.results["failed"] += 1
+            else:
+                self.results["ok"] += 1
+        except Exception as e:
+            logger.error(f"Error running command '{command}': {e}")
+            self.results["failed"] += 1
+        finally:
+            window.release()
+
+    def summary(self, elapsed):
+        total = sum(self.results.values())
+        latency = self.latency.summary()
+        throughput = total / elapsed if elapsed > 0 else 0.0
+        return (
+            f"Batch summary: {total} commands in {elapsed:.2f}s ({throughput:.1f} commands/s, window {self.window})\n"
+            f"    ok: {self.results['ok']}, failed: {self.results['failed']}, no reply: {self.results['no reply']}\n"
+            f"    latency ms: p50 {latency['p50'] * 1000:.1f}, p95 {latency['p95'] * 1000:.1f}, p99 {latency['p99'] * 1000:.1f}, max {latency['max'] * 1000:.1f}"
+        )
@@ -1,15 +1,177 @@
-from terminal_interpreter import TerminalInterpreter
+"""Application components, each built on first access (e.g. class_factory.mqueue).
+
+Building lazily keeps startup to what the chosen mode uses: replaying a recording never
+imports nats, and a terminal attached to a daemon never opens its own NATS connection.
+"""
 from dunebugger_settings import settings
-from mqueue import NATSComm
-from mqueue_handler import MessagingQueueHandler
-
-mqueue_handler = MessagingQueueHandler()
-mqueue = NATSComm(
-    nat_servers=settings.mQueueServers,
-    client_id=settings.mQueueClientID,
-    subject_root=settings.mQueueSubjectRoot,
-    mqueue_handler=mqueue_handler,
-)
-mqueue_handler.mqueue_sender = mqueue
-terminal_interpreter = TerminalInterpreter(mqueue_handler)
-mqueue_handler.terminal_interpreter = terminal_interpreter
+from dunebugger_logging import logger, set_logger_level
+from metrics import metrics, PrometheusTextfileWriter
+from startup_timing import startup_timer
+
+metrics.enabled = settings.metricsEnabled
+
+
+def _component(name):
+    # Module __getattr__ only serves attribute access from outside, not global lookups here
+    return globals()[name] if name in globals() else __getattr__(name)
+
+
+def _build_mqueue_handler():
+    from mqueue_handler import MessagingQueueHandler
+
+    mqueue_handler = MessagingQueueHandler()
+    metrics.register_collector(mqueue_handler.request_tracker.collect_metrics)
+    metrics.register_collector(mqueue_handler.codec.collect_metrics)
+    metrics.register_collector(mqueue_handler.reply_assembler.collect_metrics)
+    startup_timer.mark("mqueue_handler init")
+    return mqueue_handler
+
+
+def _build_terminal_interpreter():
+    from terminal_interpreter import TerminalInterpreter
+
+    mqueue_handler = _component("mqueue_handler")
+    terminal_interpreter = TerminalInterpreter(mqueue_handler)
+    mqueue_handler.terminal_interpreter = terminal_interpreter
+    metrics.register_collector(terminal_interpreter.core_log_relay.collect_metrics)
+    startup_timer.mark("terminal_interpreter init")
+    return terminal_interpreter
+
+
+def _build_outbound_buffer():
+    from outbound_buffer import OutboundBuffer
+
+    outbound_buffer = OutboundBuffer(
+        max_messages=settings.outboundBufferSize,
+        max_bytes=settings.outboundBufferMaxBytes,
+        max_age=settings.outboundBufferMaxAge,
+    )
+    metrics.register_collector(outbound_buffer.collect_metrics)
+    return outbound_buffer
+
+
+def _build_inbound_dispatcher():
+    from inbound_dispatcher import InboundDispatcher, parse_queue_sizes
+
+    inbound_dispatcher = InboundDispatcher(
+        queue_sizes=parse_queue_sizes(settings.inboundQueueSizes),
+        workers=settings.inboundWorkers,
+    )
+    metrics.register_collector(inbound_dispatcher.collect_metrics)
+    return inbound_dispatcher
+
+
+def _build_mqueue():
+    from mqueue import NATSComm
+
+    # 'loopback://' servers use the in-process stand-in instead of a real NATS server
+    if settings.mQueueServers.startswith("loopback://"):
+        from loopback_nats import LoopbackNATS
+
+        nats_client = LoopbackNATS()
+    else:
+        nats_client = None
+    mqueue_handler = _component("mqueue_handler")
+    mqueue = NATSComm(
+        nat_servers=settings.mQueueServers,
+        client_id=settings.mQueueClientID,
+        subject_root=settings.mQueueSubjectRoot,
+        mqueue_handler=mqueue_handler,
+        outbound_buffer=_component("outbound_buffer"),
+        inbound_dispatcher=_component("inbound_dispatcher"),
+        nats_client=nats_client,
+    )
+    mqueue_handler.mqueue_sender = mqueue
+    startup_timer.mark("mqueue init")
+    return mqueue
+
+
+def _build_metrics_writer():
+    return PrometheusTextfileWriter(metrics, settings.metricsTextfile, settings.metricsInterval)
+
+
+def _built(name):
+    """Return the component if it was built, None otherwise: settings only apply to what exists."""
+    return globals().get(name)
+
+
+async def _apply_mqueue_servers(changed):
+    mqueue = _built("mqueue")
+    if mqueue is None:
+        # Attached to a terminal daemon, which owns the NATS connection and watches its own config
+        logger.info("mQueueServers changed, ignored by this terminal: the NATS connection belongs to the terminal daemon")
+        return
+    await mqueue.switch_servers(changed["mQueueServers"])
+
+
+def _apply_mqueue_handler(changed):
+    mqueue_handler = _built("mqueue_handler")
+    if mqueue_handler is None:
+        return
+    mqueue_handler.request_tracker.timeout = settings.mQueueReplyTimeout
+    mqueue_handler.reply_assembler.timeout = settings.chunkTimeout
+    mqueue_handler.codec.set_preferred(settings.payloadCodec)
+    mqueue_handler.codec.codec_threshold = settings.payloadCodecThreshold
+    mqueue_handler.codec.compress_threshold = settings.payloadCompressThreshold
+
+
+def _apply_outbound_buffer(changed):
+    outbound_buffer = _built("outbound_buffer")
+    if outbound_buffer is not None:
+        outbound_buffer.max_messages = settings.outboundBufferSize
+        outbound_buffer.max_bytes = settings.outboundBufferMaxBytes
+        outbound_buffer.max_age = settings.outboundBufferMaxAge
+
+
+def _apply_terminal_interpreter(changed):
+    terminal_interpreter = _built("terminal_interpreter")
+    if terminal_interpreter is not None:
+        terminal_interpreter.apply_settings()
+
+
+async def _apply_metrics(changed):
+    metrics.enabled = settings.metricsEnabled
+    metrics_writer = _built("metrics_writer")
+    if metrics_writer is None:
+        return
+    metrics_writer.interval = settings.metricsInterval
+    # The writer only runs while metrics are enabled, start() does nothing when disabled
+    if settings.metricsEnabled:
+        metrics_writer.start()
+    else:
+        await metrics_writer.stop()
+
+
+def _build_config_watcher():
+    from config_watcher import ConfigWatcher
+
+    config_watcher = ConfigWatcher(settings, settings.configPollInterval)
+    config_watcher.watch(lambda changed: set_logger_level("dunebuggerLog", settings.dunebuggerLogLevel), "dunebuggerLogLevel")
+    config_watcher.watch(_apply_mqueue_servers, "mQueueServers")
+    config_watcher.watch(_apply_mqueue_handler, "mQueueReplyTimeout", "chunkTimeout", "payloadCodec", "payloadCodecThreshold", "payloadCompressThreshold")
+    config_watcher.watch(_apply_outbound_buffer, "outboundBufferSize", "outboundBufferMaxBytes", "outboundBufferMaxAge")
+    config_watcher.watch(
+        _apply_terminal_interpreter, "coreLogMinLevel", "coreLogRateLimit", "coreLogDedupWindow", "fleetCores", "fleetDeadline", "commandHistoryLength"
+    )
+    config_watcher.watch(_apply_metrics, "metricsEnabled", "metricsInterval")
+    return config_watcher
+
+
+_FACTORIES = {
+    "mqueue_handler": _build_mqueue_handler,
+    "terminal_interpreter": _build_terminal_interpreter,
+    "outbound_buffer": _build_outbound_buffer,
+    "inbound_dispatcher": _build_inbound_dispatcher,
+    "mqueue": _build_mqueue,
+    "metrics_writer": _build_metrics_writer,
+    "config_watcher": _build_config_watcher,
+}
+
+
+def __getattr__(name):
+    factory = _FACTORIES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Store the instance as a module global, so later lookups don't come back here
+    instance = globals()[name] = factory()
+    return instance
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+from dunebugger_logging import logger
+
+
+def content_hash(commands_list):
+    """Stable hash of a commands_list, independent of key order."""
+    canonical = json.dumps(commands_list, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CommandsCache:
+    """Local copy of the last commands_list received from the core, stored with its content hash.
+
+    Without a cache_file it is only kept in memory."""
+
+    def __init__(self, cache_file):
+        self.cache_file = os.path.expanduser(cache_file) if cache_file else None
+        self.cached = (None, None)
+
+    def load(self):
+        """Return (commands_list, hash) from the cache file, or (None, None) if there is no usable cache."""
+        if self.cache_file is None:
+            return self.cached
+        try:
+            with open(self.cache_file) as cache:
+                cached = json.load(cache)
+            commands_list = cached["commands_list"]
+            if content_hash(commands_list) != cached["hash"]:
+                logger.warning(f"Ignoring corrupted commands cache {self.cache_file}")
+                return None, None
+            return commands_list, cached["hash"]
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Error reading commands cache {self.cache_file}: {e}")
+            return None, None
+
+    def save(self, commands_list, commands_hash):
+        """Write the cache atomically, so a crash never leaves a truncated file behind."""
+        if self.cache_file is None:
+            self.cached = (commands_list, commands_hash)
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+            temp_file = f"{self.cache_file}.tmp"
+            with open(temp_file, "w") as cache:
+                json.dump({"hash": commands_hash, "commands_list": commands_list}, cache)
+            os.replace(temp_file, self.cache_file)
+            logger.debug(f"Commands list cached to {self.cache_file}")
+        except OSError as e:
+            logger.warning(f"Error writing commands cache {self.cache_file}: {e}")
@@ -0,0 +1,61 @@
+import asyncio
+import inspect
+from dunebugger_logging import logger
+
+
+class ConfigWatcher:
+    """Polls the configuration file and applies changes without restarting.
+
+    A stat() every interval seconds is all it costs while nothing changes. When the file's
+    mtime or size changes, settings.reload() re-reads it and each callback registered with
+    watch() is called with the changed options it asked for. Changed options nobody watches
+    only take effect after a restart, which is logged.
+    """
+
+    def __init__(self, settings, interval=2):
+        self.settings = settings
+        self.interval = interval
+        self.watchers = []  # (options, callback)
+        self.reloads = 0
+        self.task = None
+
+    def watch(self, callback, *options):
+        """Call callback({option: value}) when any of options changes; callback may be a coroutine function."""
+        self.watchers.append((set(options), callback))
+
+    def start(self):
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.settings.config_stamp(self.settings.dunebugger_config) != self.settings.config_mtime:
+                await self.reload()
+
+    async def reload(self):
+        changed = self.settings.reload()
+        if not changed:
+            return
+        self.reloads += 1
+        logger.info(f"Configuration changed: {', '.join(f'{option} = {value}' for option, value in changed.items())}")
+        unapplied = set(changed)
+        for options, callback in self.watchers:
+            updates = {option: value for option, value in changed.items() if option in options}
+            if not updates:
+                continue
+            unapplied -= options
+            try:
+                result = callback(updates)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error applying {', '.join(updates)}: {e}")
+        if unapplied:
+            logger.warning(f"Restart to apply: {', '.join(sorted(unapplied))}")
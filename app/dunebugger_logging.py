@@ -1,10 +1,12 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
+import threading
+import time
 from os import path
-
-logConfig = path.join(path.dirname(path.abspath(__file__)), "config/dunebuggerlogging.conf")
-logging.config.fileConfig(logConfig)  # load logging config file
-logger = logging.getLogger("dunebuggerLog")
+from startup_timing import startup_timer
 
 COLORS = {
     "RED": "\033[91m",
@@ -18,18 +20,137 @@ COLORS = {
 
 
 class CustomFormatter(logging.Formatter):
-    def format(self, record):
+    LEVEL_COLORS = {
+        logging.ERROR: COLORS["RED"],
+        logging.WARNING: COLORS["YELLOW"],
+        logging.DEBUG: COLORS["BLUE"],
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Build the colored formatters once instead of on every record
         log_fmt = self._style._fmt
-        if record.levelno == logging.ERROR:
-            log_fmt = COLORS["RED"] + log_fmt + COLORS["RESET"]
-        elif record.levelno == logging.WARNING:
-            log_fmt = COLORS["YELLOW"] + log_fmt + COLORS["RESET"]
-        elif record.levelno == logging.DEBUG:
-            log_fmt = COLORS["BLUE"] + log_fmt + COLORS["RESET"]
-        formatter = logging.Formatter(log_fmt, self.datefmt)
+        self.level_formatters = {level: logging.Formatter(color + log_fmt + COLORS["RESET"], self.datefmt) for level, color in self.LEVEL_COLORS.items()}
+
+    def format(self, record):
+        formatter = self.level_formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
 
 
+class BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that collects formatted records and writes them in batches.
+
+    Pending records are written when batch_size records are buffered, when flush_interval
+    seconds have passed since the last write, or when flush() is called. The file is rotated
+    once it grows past maxBytes.
+    """
+
+    def __init__(self, filename, mode="a", maxBytes=0, backupCount=0, encoding=None, delay=False, flush_interval=1.0, batch_size=100):
+        super().__init__(filename, mode, maxBytes, backupCount, encoding, delay)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            self.pending.append(self.format(record) + self.terminator)
+            if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.pending:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write("".join(self.pending))
+                self.pending.clear()
+                self.stream.flush()
+                if self.maxBytes > 0 and self.stream.tell() >= self.maxBytes:
+                    self.doRollover()
+            self.last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class LogWriter:
+    """Background thread that hands queued log records to the file handlers.
+
+    Keeps disk I/O off the asyncio loop: loggers only put records on a queue, and idle
+    handlers are flushed every flush_interval seconds.
+    """
+
+    _stop = object()
+
+    def __init__(self, log_queue, handlers, flush_interval=1.0):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.thread = threading.Thread(target=self._run, name="dunebugger-log-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.queue.put(self._stop)
+            self.thread.join(timeout=5)
+
+    def _flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._flush()
+                continue
+            if record is self._stop:
+                self._flush()
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def start_log_writer(*loggers):
+    """Move the file handlers of loggers behind a queue drained by a LogWriter thread."""
+    file_handlers = []
+    for logger_ in loggers:
+        for handler in logger_.handlers:
+            if isinstance(handler, logging.FileHandler) and handler not in file_handlers:
+                file_handlers.append(handler)
+    if not file_handlers:
+        return None
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Records no file handler wants are dropped here, before they are formatted on the caller's thread
+    queue_handler.setLevel(min(handler.level for handler in file_handlers))
+    for logger_ in loggers:
+        if any(handler in file_handlers for handler in logger_.handlers):
+            for handler in file_handlers:
+                logger_.removeHandler(handler)
+            logger_.addHandler(queue_handler)
+
+    flush_interval = min(getattr(handler, "flush_interval", 1.0) for handler in file_handlers)
+    writer = LogWriter(log_queue, file_handlers, flush_interval)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
+
 def get_logging_level_from_name(level_str):
     # Convert the string level to a logging level
     level = getattr(logging, level_str.upper(), None)
@@ -48,6 +169,14 @@ def set_logger_level(logger_name, level):
         logging.getLogger(logger_name).error(f"Error while setting logger ${logger_name} level to {logging.getLevelName(logger.level)}: ${str(exc)}")
 
 
+logConfig = path.join(path.dirname(path.abspath(__file__)), "config/dunebuggerlogging.conf")
+logging.config.fileConfig(logConfig)  # load logging config file
+logger = logging.getLogger("dunebuggerLog")
+
 # Get the console handler and set the custom formatter
 console_handler = logger.handlers[0]
 console_handler.setFormatter(CustomFormatter("%(levelname)s - %(asctime)s : %(message)s", "%d/%m/%Y %H:%M:%S"))
+
+# File writes happen on a background thread, not on the asyncio loop
+log_writer = start_log_writer(logging.getLogger(), logger)
+startup_timer.mark("logging init")
@@ -1,26 +1,86 @@
+import os
 from os import path
 import configparser
 from dunebugger_logging import logger, get_logging_level_from_name, set_logger_level
-from utils import is_raspberry_pi
+from utils import is_raspberry_pi, positive_int
+from startup_timing import startup_timer
 
 
 class DunebuggerSettings:
+    SECTIONS = ["General", "MessageQueue", "Fleet", "Log", "Metrics"]
+    # Used for options missing from the configuration file, e.g. one written for an older version
+    DEFAULTS = {
+        "General": {
+            "commandsCacheFile": "~/.cache/dunebugger/commands_list.json",
+            "commandHistoryLength": "1000",
+            "daemonSocket": "",
+            "historyCapacity": "5000",
+            "historyMaxText": "500",
+            "configPollInterval": "2",
+        },
+        "MessageQueue": {
+            "mQueueServers": "nats://nats-server:4222",
+            "mQueueClientID": "terminal",
+            "mQueueSubjectRoot": "dunebugger",
+            "mQueueReplyTimeout": "10",
+            "chunkTimeout": "10",
+            "outboundBufferSize": "100",
+            "outboundBufferMaxBytes": "65536",
+            "outboundBufferMaxAge": "30",
+            "inboundQueueSizes": "high:0, normal:200, low:1000",
+            "inboundWorkers": "1",
+            "payloadCodec": "msgpack",
+            "payloadCodecThreshold": "512",
+            "payloadCompressThreshold": "1024",
+        },
+        "Fleet": {
+            "fleetCores": "core",
+            "fleetDeadline": "5",
+        },
+        "Log": {
+            "dunebuggerLogLevel": "DEBUG",
+            "coreLogMinLevel": "DEBUG",
+            "coreLogRateLimit": "DEBUG:10, INFO:20, WARNING:50, ERROR:0, CRITICAL:0",
+            "coreLogDedupWindow": "2",
+        },
+        "Metrics": {
+            "metricsEnabled": "True",
+            "metricsTextfile": "",
+            "metricsInterval": "15",
+        },
+    }
+
     def __init__(self):
-        self.config = configparser.ConfigParser()
-        # Set optionxform to lambda x: x to preserve case
-        self.config.optionxform = lambda x: x
+        self.config = self._new_parser()
         self.dunebugger_config = path.join(path.dirname(path.abspath(__file__)), "config/dunebugger.conf")
         self.load_configuration(self.dunebugger_config)
         self.override_configuration()
         set_logger_level("dunebuggerLog", self.dunebuggerLogLevel)
 
+    @staticmethod
+    def _new_parser():
+        config = configparser.ConfigParser()
+        # Set optionxform to lambda x: x to preserve case
+        config.optionxform = lambda x: x
+        return config
+
+    def _read(self, dunebugger_config):
+        """Parse the configuration file over DEFAULTS. Returns (merged, file only) parsers."""
+        from_file = self._new_parser()
+        from_file.read(dunebugger_config)
+        config = self._new_parser()
+        config.read_dict(self.DEFAULTS)
+        config.read_dict({section: dict(from_file.items(section, raw=True)) for section in from_file.sections()})
+        return config, from_file
+
     def load_configuration(self, dunebugger_config=None):
         if dunebugger_config is None:
             dunebugger_config = self.dunebugger_config
 
         try:
-            self.config.read(dunebugger_config)
-            for section in ["General", "MessageQueue", "Log"]:
+            self.config_mtime = self.config_stamp(dunebugger_config)
+            self.config, self.from_file = self._read(dunebugger_config)
+            for section in self.SECTIONS:
                 for option in self.config.options(section):
                     value = self.config.get(section, option)
                     setattr(self, option, self.validate_option(section, option, value))
@@ -32,15 +92,79 @@ class DunebuggerSettings:
         except configparser.Error as e:
             logger.error(f"Error reading {dunebugger_config} configuration: {e}")
 
+    @staticmethod
+    def config_stamp(dunebugger_config):
+        """Return (mtime, size) of the configuration file, None if it can't be read."""
+        try:
+            stat = os.stat(dunebugger_config)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def reload(self):
+        """Re-read the configuration file and apply the sections that changed since the last read.
+
+        Returns {option: value} of the options whose value changed. Options removed from
+        the file go back to their default. An invalid file leaves the current settings in place.
+        """
+        self.config_mtime = self.config_stamp(self.dunebugger_config)
+        try:
+            config, from_file = self._read(self.dunebugger_config)
+            updates = {}
+            for section in self.SECTIONS:
+                current = dict(self.config.items(section, raw=True))
+                options = dict(config.items(section, raw=True))
+                for option, value in options.items():
+                    if self.from_file.has_option(section, option) and not from_file.has_option(section, option):
+                        logger.info(f"{option} removed from {self.dunebugger_config}, reverted to default: {value!r}")
+                    if current.get(option) != value:
+                        updates[option] = self.validate_option(section, option, value)
+        except (configparser.Error, ValueError) as e:
+            logger.error(f"Error reloading {self.dunebugger_config}, keeping the current configuration: {e}")
+            return {}
+
+        self.config, self.from_file = config, from_file
+        for option, value in updates.items():
+            setattr(self, option, value)
+            logger.debug(f"{option}: {value}")
+        return updates
+
     def validate_option(self, section, option, value):
         # Validation for specific options
         try:
             if section == "General":
-                pass
+                if option in ["commandsCacheFile", "daemonSocket"]:
+                    return str(value)
+                elif option in ["historyCapacity"]:
+                    return positive_int(value)
+                elif option in ["historyMaxText", "commandHistoryLength"]:
+                    return int(value)
+                elif option in ["configPollInterval"]:
+                    return float(value)
             elif section == "MessageQueue":
-                if option in ["mQueueServers", "mQueueClientID", "mQueueSubjectRoot"]:
+                if option in ["mQueueServers", "mQueueClientID", "mQueueSubjectRoot", "inboundQueueSizes", "payloadCodec"]:
+                    return str(value)
+                elif option in ["mQueueReplyTimeout", "outboundBufferMaxAge", "chunkTimeout"]:
+                    return float(value)
+                elif option in ["outboundBufferSize", "outboundBufferMaxBytes", "inboundWorkers", "payloadCodecThreshold", "payloadCompressThreshold"]:
+                    return int(value)
+            elif section == "Fleet":
+                if option in ["fleetCores"]:
+                    return str(value)
+                elif option in ["fleetDeadline"]:
+                    return float(value)
+            elif section == "Metrics":
+                if option in ["metricsEnabled"]:
+                    return value.strip().lower() in ["true", "yes", "on", "1"]
+                elif option in ["metricsInterval"]:
+                    return float(value)
+                elif option in ["metricsTextfile"]:
                     return str(value)
             elif section == "Log":
+                if option in ["coreLogRateLimit"]:
+                    return str(value)
+                elif option in ["coreLogDedupWindow"]:
+                    return float(value)
                 logLevel = get_logging_level_from_name(value)
                 if logLevel == "":
                     return get_logging_level_from_name("INFO")
@@ -59,3 +183,4 @@ class DunebuggerSettings:
 
 
 settings = DunebuggerSettings()
+startup_timer.mark("config load")
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from fnmatch import fnmatchcase
+from dunebugger_logging import logger
+
+
+def parse_core_list(text):
+    """Parse 'core1, core2 core3' into a list of core IDs or glob patterns."""
+    return [item for item in text.replace(",", " ").split() if item]
+
+
+def summarize_reply(reply):
+    """Return a one-line summary of a reply body for the fleet table."""
+    body = reply["body"]
+    if reply["subject"] == "terminal_command_reply":
+        lines = str(body.get("message", "")).strip().splitlines()
+        return lines[0] if lines else ""
+    if reply["subject"] == "show_gpio_status":
+        return f"{len(body)} pins"
+    if reply["subject"] == "show_configuration":
+        return f"{sum(len(setting) for setting in body)} settings"
+    return reply["subject"]
+
+
+class FleetManager:
+    """Sends one command to several cores at once and gathers their replies into a table.
+
+    Targets are core IDs or glob patterns, expanded against the configured cores plus
+    every core seen as the source of an inbound message. Each core gets its own
+    correlation ID, so replies are matched per core; cores that have not answered by
+    the deadline are reported as timed out.
+    """
+
+    def __init__(self, mqueue_handler, renderer, cores=(), deadline=5.0):
+        self.mqueue_handler = mqueue_handler
+        self.renderer = renderer
+        self.configured_cores = set(cores)
+        self.deadline = deadline
+        self.targets = []
+
+    @property
+    def active(self):
+        return bool(self.targets)
+
+    def roster(self):
+        return sorted(self.configured_cores | self.mqueue_handler.known_sources)
+
+    def set_targets(self, patterns):
+        self.targets = list(patterns)
+
+    def resolve_targets(self):
+        """Expand the target patterns against the roster, keeping explicit IDs even if unseen."""
+        roster = self.roster()
+        cores = []
+        for pattern in self.targets:
+            if any(char in pattern for char in "*?["):
+                matches = [core for core in roster if fnmatchcase(core, pattern)]
+            else:
+                matches = [pattern]
+            cores.extend(core for core in matches if core not in cores)
+        return cores
+
+    async def run(self, command):
+        """Send command to every target core and render one row per core."""
+        cores = self.resolve_targets()
+        if not cores:
+            logger.warning(f"No cores match fleet targets: {', '.join(self.targets)}")
+            return []
+
+        start = time.monotonic()
+        futures = await asyncio.gather(*(self.mqueue_handler.dispatch_message(command, "terminal_command", core, quiet=True) for core in cores))
+        await asyncio.wait(futures, timeout=self.deadline)
+
+        rows = []
+        for core, future in zip(cores, futures):
+            reply = future.result() if future.done() else None
+            if reply is None:
+                status = "timeout" if not future.done() else "no reply"
+                rows.append((core, status, None, ""))
+            elif reply["subject"] == "terminal_command_reply" and not reply["body"].get("success", True):
+                rows.append((core, "failed", reply["latency"], summarize_reply(reply)))
+            else:
+                rows.append((core, "ok", reply["latency"], summarize_reply(reply)))
+        self.renderer.write(self.renderer.render_fleet_table(command, rows, time.monotonic() - start))
+        return rows
+
+    def status(self):
+        targets = ", ".join(self.targets) if self.targets else "off"
+        roster = ", ".join(self.roster()) or "none"
+        return f"Fleet targets: {targets}\nKnown cores: {roster}\nDeadline: {self.deadline:g}s"
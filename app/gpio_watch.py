@@ -0,0 +1,116 @@
+import asyncio
+import shutil
+from dunebugger_logging import logger
+
+CLEAR_SCREEN = "\033[2J\033[H"
+CLEAR_LINE = "\033[2K"
+
+
+class GpioWatcher:
+    """Keeps the last GPIO status snapshot and redraws only the pins that changed.
+
+    In watch mode the status is requested every interval seconds. On a TTY the table is
+    drawn once, cut to the terminal height, and changed rows are rewritten in place by moving
+    up from the line below it; otherwise only changed pins are printed. output_mark() must
+    return a value that changes whenever other output may have scrolled the terminal, and
+    the whole table is drawn again when it does (or when there is no output_mark).
+    """
+
+    HEADER_ROWS = 1
+    MIN_INTERVAL = 0.2  # each poll is a command to the core, don't flood it
+
+    def __init__(self, request_status, renderer, output_mark=None):
+        self.request_status = request_status
+        self.renderer = renderer
+        self.output_mark = output_mark
+        self.drawn_mark = None
+        self.snapshot = {}
+        self.rows = {}  # pin -> lines above the line below the table, for the pins on screen
+        self.active = False
+        self.interval = 1.0
+        self.poll_task = None
+
+    @staticmethod
+    def _row_key(gpio_info):
+        return (gpio_info["label"], gpio_info["mode"], gpio_info["state"], gpio_info["switch"])
+
+    def diff(self, gpio_status):
+        """Update the snapshot and return (changed gpio_info list, whether the pin set changed)."""
+        pins = [gpio_info["pin"] for gpio_info in gpio_status]
+        layout_changed = pins != list(self.snapshot)
+        changed = []
+        snapshot = {}
+        for gpio_info in gpio_status:
+            key = self._row_key(gpio_info)
+            if layout_changed or self.snapshot.get(gpio_info["pin"]) != key:
+                changed.append(gpio_info)
+            snapshot[gpio_info["pin"]] = key
+        self.snapshot = snapshot
+        return changed, layout_changed
+
+    def render_full(self, gpio_status, write=None):
+        self.diff(gpio_status)
+        (write or self.renderer.write)(self.renderer.render_gpio_status(gpio_status))
+
+    def render_update(self, gpio_status):
+        changed, layout_changed = self.diff(gpio_status)
+        if not changed:
+            return
+
+        render_row = self.renderer.render_gpio_row
+        if not self.renderer.stream.isatty():
+            self.renderer.write("\n".join(map(render_row, changed)) + "\n")
+            return
+
+        mark = self.output_mark() if self.output_mark is not None else None
+        if layout_changed or not self.rows or mark is None or mark != self.drawn_mark:
+            self._draw_table(gpio_status, clear=layout_changed or not self.rows)
+            return
+
+        parts = []
+        for gpio_info in changed:
+            up = self.rows.get(gpio_info["pin"])
+            if up is not None:
+                parts.append(f"\r\033[{up}A{CLEAR_LINE}{render_row(gpio_info)}\r\033[{up}B")
+        if parts:
+            self.renderer.write("".join(parts))
+            self.drawn_mark = self.output_mark()
+
+    def _draw_table(self, gpio_status, clear):
+        # Leave room for the prompt: rows moved off the top of the screen can't be rewritten
+        room = shutil.get_terminal_size().lines - self.HEADER_ROWS - 1
+        shown = gpio_status if len(gpio_status) <= room else gpio_status[: max(room - 1, 1)]
+        lines = [f"{CLEAR_SCREEN if clear else ''}{self.renderer.title}Watching GPIO status every {self.interval:g}s ('watch off' to stop){self.renderer.reset}"]
+        lines.extend(map(self.renderer.render_gpio_row, shown))
+        if len(shown) < len(gpio_status):
+            lines.append(f"({len(gpio_status) - len(shown)} more pins not shown, enlarge the terminal to watch them)")
+        self.rows = {gpio_info["pin"]: len(lines) - self.HEADER_ROWS - index for index, gpio_info in enumerate(shown)}
+        self.renderer.write("\n".join(lines) + "\n")
+        if self.output_mark is not None:
+            self.drawn_mark = self.output_mark()
+
+    def start(self, interval=None):
+        if interval is not None:
+            if not interval >= self.MIN_INTERVAL:
+                raise ValueError(f"Watch interval must be at least {self.MIN_INTERVAL:g}s, got {interval:g}")
+            self.interval = interval
+        self.active = True
+        self.rows = {}
+        self.snapshot = {}
+        if self.poll_task is None or self.poll_task.done():
+            self.poll_task = asyncio.create_task(self._poll())
+
+    def stop(self):
+        self.active = False
+        self.rows = {}
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            self.poll_task = None
+
+    async def _poll(self):
+        while self.active:
+            try:
+                await self.request_status()
+            except Exception as e:
+                logger.error(f"Error requesting GPIO status: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import deque
+from dunebugger_logging import logger
+from request_tracker import LatencyStats
+from utils import parse_subject
+
+# Lower value is served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+SUBJECT_PRIORITIES = {
+    "terminal_command_reply": PRIORITY_HIGH,
+    "commands_list": PRIORITY_HIGH,
+    "show_gpio_status": PRIORITY_NORMAL,
+    "show_configuration": PRIORITY_NORMAL,
+    "log_message": PRIORITY_LOW,
+}
+
+
+def parse_queue_sizes(text):
+    """Parse 'high:0, normal:500, low:1000' into {priority: max size}. A size of 0 means unbounded."""
+    names = {name: priority for priority, name in PRIORITY_NAMES.items()}
+    sizes = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, size = item.partition(":")
+        sizes[names[name.strip().lower()]] = int(size)
+    return sizes
+
+
+class InboundQueue:
+    """FIFO for one priority class; when bounded, the oldest message is dropped on overflow."""
+
+    def __init__(self, max_size=0):
+        self.items = deque()
+        self.max_size = max_size
+        self.max_depth = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.wait = LatencyStats()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, message):
+        if self.max_size and len(self.items) >= self.max_size:
+            self.items.popleft()
+            self.dropped += 1
+        self.items.append((time.monotonic(), message))
+        self.enqueued += 1
+        if len(self.items) > self.max_depth:
+            self.max_depth = len(self.items)
+
+    def get(self):
+        queued_at, message = self.items.popleft()
+        self.wait.add(time.monotonic() - queued_at)
+        return message
+
+
+class InboundDispatcher:
+    """Per-priority inbound queues drained by worker tasks.
+
+    The subscription callback only enqueues, so a command reply is processed before any
+    backlog of GPIO status or log messages instead of waiting behind it.
+    """
+
+    def __init__(self, queue_sizes=None, workers=1, process=None):
+        queue_sizes = queue_sizes or {}
+        self.queues = {priority: InboundQueue(queue_sizes.get(priority, 0)) for priority in PRIORITY_NAMES}
+        self.workers = workers
+        self.process = process
+        self.available = asyncio.Event()
+        self.worker_tasks = []
+
+    def put(self, mqueue_message):
+        try:
+            priority = SUBJECT_PRIORITIES.get(parse_subject(mqueue_message.subject), PRIORITY_NORMAL)
+        except (AttributeError, IndexError):
+            priority = PRIORITY_NORMAL
+        queue = self.queues[priority]
+        dropped = queue.dropped
+        queue.put(mqueue_message)
+        if queue.dropped != dropped and queue.dropped % 100 == 1:
+            logger.warning(f"Inbound {PRIORITY_NAMES[priority]} priority queue full, dropping oldest messages ({queue.dropped} dropped so far)")
+        self.available.set()
+
+    def _next(self):
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            if queue.items:
+                return queue.get()
+        return None
+
+    async def _worker(self):
+        while True:
+            await self.available.wait()
+            mqueue_message = self._next()
+            if mqueue_message is None:
+                self.available.clear()
+                continue
+            try:
+                await self.process(mqueue_message)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+
+    def start(self):
+        if not self.worker_tasks:
+            self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    def get_stats(self):
+        stats = {}
+        for priority, queue in self.queues.items():
+            wait = queue.wait.summary()
+            stats[PRIORITY_NAMES[priority]] = {
+                "depth": len(queue),
+                "max_depth": queue.max_depth,
+                "max_size": queue.max_size,
+                "enqueued": queue.enqueued,
+                "dropped": queue.dropped,
+                "wait_p50": wait["p50"],
+                "wait_p95": wait["p95"],
+                "wait_p99": wait["p99"],
+                "wait_max": wait["max"],
+            }
+        return stats
+
+    def collect_metrics(self):
+        stats = self.get_stats()
+        return [
+            ("inbound_queue_depth", "gauge", "Messages waiting in the inbound queues", [({"priority": name}, s["depth"]) for name, s in stats.items()]),
+            ("inbound_queue_dropped_total", "counter", "Inbound messages dropped on queue overflow", [({"priority": name}, s["dropped"]) for name, s in stats.items()]),
+            ("inbound_queue_wait_p95_seconds", "gauge", "95th percentile of the time spent in the inbound queues", [({"priority": name}, s["wait_p95"]) for name, s in stats.items()]),
+        ]
+
+    def queues_report(self):
+        """Return a printable table of queue depths and wait times."""
+        lines = [f"{'queue':<8}{'depth':>8}{'max':>8}{'limit':>8}{'enqueued':>10}{'dropped':>10}{'wait p50 ms':>13}{'p95 ms':>10}{'p99 ms':>10}"]
+        for name, s in self.get_stats().items():
+            limit = s["max_size"] or "-"
+            lines.append(f"{name:<8}{s['depth']:>8}{s['max_depth']:>8}{limit:>8}{s['enqueued']:>10}{s['dropped']:>10}{s['wait_p50'] * 1000:>13.2f}{s['wait_p95'] * 1000:>10.2f}{s['wait_p99'] * 1000:>10.2f}")
+        return "\n".join(lines)
@@ -0,0 +1,43 @@
+import json
+
+# orjson is a requirement: the inbound path is only faster than the plain json decoding with it.
+# The json fallback keeps the tools working where it cannot be installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Serialize to JSON bytes."""
+        return orjson.dumps(obj, default=str)
+
+else:
+    BACKEND = "json"
+    JSONDecodeError = json.JSONDecodeError
+    _decoder = json.JSONDecoder()
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        if isinstance(data, (bytes, bytearray)):
+            # json.loads would detect the encoding of bytes first, payloads are always UTF-8
+            data = data.decode()
+        try:
+            value, end = _decoder.raw_decode(data)
+            if end == len(data):
+                return value
+        except JSONDecodeError:
+            pass
+        # Surrounding whitespace or invalid JSON: decode() skips the one and reports the other
+        return _decoder.decode(data)
+
+    def dumps(obj):
+        """Serialize to JSON bytes."""
+        return json.dumps(obj, default=str).encode()
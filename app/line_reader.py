@@ -0,0 +1,393 @@
+import asyncio
+import codecs
+import os
+import re
+import readline
+import shutil
+import sys
+
+try:
+    import termios
+    import tty
+except ImportError:  # not a POSIX terminal
+    termios = None
+
+# Clears the current row and the ones below it, where input wider than the terminal wraps to
+CLEAR_LINE = "\r\033[J"
+ANSI_ESCAPE = re.compile(r"\033\[[0-9;?]*[A-Za-z]")
+
+ESCAPE_KEYS = {
+    "\x1b[A": "up",
+    "\x1bOA": "up",
+    "\x1b[B": "down",
+    "\x1bOB": "down",
+    "\x1b[C": "right",
+    "\x1bOC": "right",
+    "\x1b[D": "left",
+    "\x1bOD": "left",
+    "\x1b[H": "home",
+    "\x1bOH": "home",
+    "\x1b[1~": "home",
+    "\x1b[F": "end",
+    "\x1bOF": "end",
+    "\x1b[4~": "end",
+    "\x1b[3~": "delete",
+}
+
+CONTROL_KEYS = {
+    "\x01": "home",  # Ctrl-A
+    "\x02": "left",  # Ctrl-B
+    "\x04": "eof",  # Ctrl-D
+    "\x05": "end",  # Ctrl-E
+    "\x06": "right",  # Ctrl-F
+    "\x08": "backspace",
+    "\x7f": "backspace",
+    "\t": "complete",
+    "\n": "enter",
+    "\r": "enter",
+    "\x0b": "kill_end",  # Ctrl-K
+    "\x0c": "clear",  # Ctrl-L
+    "\x0e": "down",  # Ctrl-N
+    "\x10": "up",  # Ctrl-P
+    "\x15": "kill_start",  # Ctrl-U
+    "\x17": "kill_word",  # Ctrl-W
+}
+
+
+class PromptAwareStream:
+    """Wraps stdout so output printed while the user is typing doesn't mangle the prompt.
+
+    Writes are collected until a newline or flush(), then the input line is cleared, the
+    text written and the prompt with the partial input redrawn below it, in one write.
+    """
+
+    def __init__(self, stream, line_reader):
+        self.stream = stream
+        self.line_reader = line_reader
+        self.pending = []
+        self.writes = 0
+
+    def write(self, text):
+        self.pending.append(text)
+        if text.endswith("\n"):
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            text = "".join(self.pending)
+            self.pending.clear()
+            self.writes += 1
+            if self.line_reader.prompt_visible:
+                text = self.line_reader.clear_line() + text + self.line_reader.render_line()
+            self.stream.write(text)
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class AsyncLineReader:
+    """Line editor driven by the event loop instead of a blocking input() in a thread.
+
+    stdin is registered as a reader and switched to cbreak mode; keys are handled as they
+    arrive with readline-style editing (cursor movement, Ctrl-A/E/K/U/W, history through the
+    readline module history, tab completion). When stdin is not a terminal, plain lines are read.
+    """
+
+    def __init__(self, completer=None, stdin=None, stdout=None):
+        self.completer = completer
+        self.stdin = stdin or sys.stdin
+        self.output = stdout or sys.stdout
+        self.fd = self.stdin.fileno()
+        self.interactive = termios is not None and self.stdin.isatty()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.saved_attrs = None
+        self.prompt = ""
+        self.prompt_visible = False
+        self.buffer = ""
+        self.cursor = 0
+        self.escape = ""
+        self.history_index = None
+        self.draft = ""
+        self.last_action = None
+        self.lines = []
+        self.waiter = None
+        self.eof = False
+        self.reading = False
+        self.status = None  # shown instead of the prompt while set, e.g. by the pager
+        self.key_handler = None  # while set, receives every key instead of the line editor
+        self.scrolls = 0  # writes of the editor itself that moved the screen (newlines, clear screen)
+        self.cursor_row = 0  # screen row of the cursor below the first row of the prompt
+
+    def start(self):
+        """Attach to the event loop and switch the terminal to cbreak mode."""
+        if self.reading:
+            return
+        if self.interactive:
+            self.saved_attrs = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+        asyncio.get_running_loop().add_reader(self.fd, self._on_readable)
+        self.reading = True
+
+    def stop(self):
+        """Detach from the event loop and restore the terminal settings."""
+        if self.reading:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            self.reading = False
+        if self.saved_attrs is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved_attrs)
+            self.saved_attrs = None
+        self.prompt_visible = False
+
+    async def readline(self, prompt=""):
+        """Return the next line typed by the user (without newline). Raises EOFError at end of input."""
+        self.start()
+        if not self.lines and not self.eof:
+            self.prompt = prompt
+            if self.interactive:
+                self.prompt_visible = True
+                self._write(self.render_line())
+            else:
+                self._write(prompt)
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+                self.prompt_visible = False
+        if self.lines:
+            return self.lines.pop(0)
+        raise EOFError
+
+    def render_line(self):
+        """Prompt and partial input, with the terminal cursor placed at the editing position.
+
+        Replaces what was rendered before, including the rows a line wider than the terminal wrapped to.
+        """
+        clear = self.clear_line()
+        columns = self._columns()
+        if self.status is not None:
+            self.cursor_row = max(len(ANSI_ESCAPE.sub("", self.status)) - 1, 0) // columns
+            return f"{clear}{self.status}"
+        prompt_width = self._prompt_width()
+        end = prompt_width + len(self.buffer)
+        position = prompt_width + self.cursor
+        text = f"{clear}{self.prompt}{self.buffer}"
+        if end and end % columns == 0:
+            # The cursor stays on the last column of a full row until the next character, move it to the next row
+            text += " \r"
+        if position != end:
+            up = end // columns - position // columns
+            text += (f"\033[{up}A" if up else "") + "\r" + (f"\033[{position % columns}C" if position % columns else "")
+        self.cursor_row = position // columns
+        return text
+
+    def clear_line(self):
+        """Escape sequence moving the cursor to the first row of the prompt and clearing the prompt and input."""
+        up = self.cursor_row
+        self.cursor_row = 0
+        return (f"\033[{up}A" if up else "") + CLEAR_LINE
+
+    def _end_of_input(self):
+        """Escape sequence moving the cursor down to the last row of the input, before writing below it."""
+        down = (self._prompt_width() + len(self.buffer)) // self._columns() - self.cursor_row
+        self.cursor_row = 0
+        return f"\033[{down}B" if down > 0 else ""
+
+    def _prompt_width(self):
+        return len(ANSI_ESCAPE.sub("", self.prompt))
+
+    def _columns(self):
+        return max(shutil.get_terminal_size().columns, 1)
+
+    def _write(self, text):
+        if "\n" in text or "\033[2J" in text:
+            self.scrolls += 1
+        self.output.write(text)
+        self.output.flush()
+
+    def redraw(self):
+        if self.prompt_visible:
+            self._write(self.render_line())
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not data:
+            if not self.interactive:
+                # The last line may not end with a newline
+                self.buffer += self.decoder.decode(b"", final=True)
+                if self.buffer:
+                    self.lines.append(self.buffer.rstrip("\r"))
+                    self.buffer = ""
+            self.eof = True
+            asyncio.get_running_loop().remove_reader(self.fd)
+            self.reading = False
+            self._wake()
+            return
+
+        text = self.decoder.decode(data)
+        if not self.interactive:
+            self.buffer += text
+            *lines, self.buffer = self.buffer.split("\n")
+            self.lines.extend(line.rstrip("\r") for line in lines)
+            if lines:
+                self._wake()
+            return
+
+        for char in text:
+            self._feed(char)
+
+    def _feed(self, char):
+        if self.key_handler is not None:
+            self.key_handler(char)
+        elif self.escape or char == "\x1b":
+            self._feed_escape(char)
+        elif char in CONTROL_KEYS:
+            self._do(CONTROL_KEYS[char])
+        elif char.isprintable():
+            self.buffer = self.buffer[: self.cursor] + char + self.buffer[self.cursor :]
+            self.cursor += 1
+            # Typing at the end of the line only needs the character, unless it fills the last row
+            if self.cursor == len(self.buffer) and self.prompt_visible and (self._prompt_width() + self.cursor) % self._columns():
+                self._write(char)
+            else:
+                self.redraw()
+            self.last_action = "insert"
+
+    def _feed_escape(self, char):
+        self.escape += char
+        sequence = self.escape
+        if len(sequence) == 1:
+            return
+        if len(sequence) == 2:
+            complete = char not in "[O"
+        elif sequence[1] == "O":
+            complete = True
+        else:
+            # CSI sequences end with a byte in the 0x40-0x7e range
+            complete = "\x40" <= char <= "\x7e"
+        if complete:
+            self.escape = ""
+            action = ESCAPE_KEYS.get(sequence)
+            if action:
+                self._do(action)
+
+    def _do(self, action):
+        if action == "enter":
+            line = self.buffer
+            if self.prompt_visible:
+                self.prompt_visible = False
+                self._write(self._end_of_input() + "\n")
+            self.buffer = ""
+            self.cursor = 0
+            self.history_index = None
+            if line.strip():
+                length = readline.get_current_history_length()
+                if length == 0 or readline.get_history_item(length) != line:
+                    readline.add_history(line)
+            self.lines.append(line)
+            self._wake()
+        elif action == "eof":
+            if not self.buffer:
+                self.eof = True
+                self._wake()
+            else:
+                self._do("delete")
+        elif action == "backspace":
+            if self.cursor > 0:
+                self.buffer = self.buffer[: self.cursor - 1] + self.buffer[self.cursor :]
+                self.cursor -= 1
+                self.redraw()
+        elif action == "delete":
+            if self.cursor < len(self.buffer):
+                self.buffer = self.buffer[: self.cursor] + self.buffer[self.cursor + 1 :]
+                self.redraw()
+        elif action == "left":
+            if self.cursor > 0:
+                self.cursor -= 1
+                self.redraw()
+        elif action == "right":
+            if self.cursor < len(self.buffer):
+                self.cursor += 1
+                self.redraw()
+        elif action == "home":
+            self.cursor = 0
+            self.redraw()
+        elif action == "end":
+            self.cursor = len(self.buffer)
+            self.redraw()
+        elif action == "kill_end":
+            self.buffer = self.buffer[: self.cursor]
+            self.redraw()
+        elif action == "kill_start":
+            self.buffer = self.buffer[self.cursor :]
+            self.cursor = 0
+            self.redraw()
+        elif action == "kill_word":
+            start = len(self.buffer[: self.cursor].rstrip())
+            start = self.buffer.rfind(" ", 0, start) + 1
+            self.buffer = self.buffer[:start] + self.buffer[self.cursor :]
+            self.cursor = start
+            self.redraw()
+        elif action == "clear":
+            self._write("\033[2J\033[H")
+            self.cursor_row = 0
+            self.redraw()
+        elif action in ("up", "down"):
+            self._history_move(-1 if action == "up" else 1)
+        elif action == "complete":
+            self._complete()
+        self.last_action = action
+
+    def _history_move(self, step):
+        length = readline.get_current_history_length()
+        if self.history_index is None:
+            if step > 0 or length == 0:
+                return
+            self.draft = self.buffer
+            index = length
+        else:
+            index = self.history_index + step
+
+        if index < 1:
+            return
+        if index > length:
+            self.history_index = None
+            self.buffer = self.draft
+        else:
+            self.history_index = index
+            self.buffer = readline.get_history_item(index) or ""
+        self.cursor = len(self.buffer)
+        self.redraw()
+
+    def _complete(self):
+        if self.completer is None:
+            return
+        # Complete the command name: the first word after the last ';'
+        command_start = self.buffer.rfind(";", 0, self.cursor) + 1
+        word = self.buffer[command_start : self.cursor].lstrip()
+        if " " in word:
+            return
+        matches = sorted(name for name in self.completer() if name.startswith(word))
+        if not matches:
+            self._write("\a")
+            return
+        if len(matches) == 1:
+            completion = matches[0][len(word) :] + " "
+        else:
+            completion = os.path.commonprefix(matches)[len(word) :]
+        if completion:
+            self.buffer = self.buffer[: self.cursor] + completion + self.buffer[self.cursor :]
+            self.cursor += len(completion)
+            self.redraw()
+        elif self.last_action == "complete":
+            self._write(f"{self._end_of_input()}\n{'  '.join(matches)}\n")
+            self.redraw()
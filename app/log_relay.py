@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+
+def parse_rate_limits(text):
+    """Parse 'LEVEL:rate, LEVEL:rate' into {level: messages per second}. A rate of 0 means unlimited."""
+    rates = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        level, _, rate = item.partition(":")
+        rates[level.strip().upper()] = float(rate)
+    return rates
+
+
+class TokenBucket:
+    __slots__ = ("rate", "tokens", "updated")
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def allow(self, now):
+        if self.rate <= 0:
+            return True
+        # Refill, allowing bursts of up to one second worth of messages
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CoreLogRelay:
+    """Rate limits and de-duplicates log messages relayed from the core.
+
+    Messages below min_level are dropped, identical consecutive messages are collapsed
+    into a "repeated N times" line per dedup_window, and each level is limited to its
+    rate in messages per second, with a summary of what was suppressed.
+    """
+
+    def __init__(self, emit, min_level=logging.DEBUG, rate_limits=None, dedup_window=2.0):
+        self.emit = emit
+        self.min_level = min_level
+        self.dedup_window = dedup_window
+        rate_limits = rate_limits or {}
+        self.buckets = {level: TokenBucket(rate_limits.get(level, 0)) for level in LEVELS}
+        self.last_key = None
+        self.last_time = 0.0
+        self.repeats = 0
+        self.repeat_timer = None
+        self.suppressed = dict.fromkeys(LEVELS, 0)
+        self.suppressed_timer = None
+        self.counters = {"relayed": 0, "filtered": 0, "deduplicated": 0, "rate_limited": 0}
+
+    def set_min_level(self, level):
+        self.min_level = level
+
+    def set_rate_limits(self, rate_limits):
+        for level, bucket in self.buckets.items():
+            bucket.rate = rate_limits.get(level, 0)
+            bucket.tokens = min(bucket.tokens, bucket.rate)
+
+    def relay(self, level, message):
+        """Emit a core log line, or return why it was held back: "filtered", "deduplicated" or "rate_limited"."""
+        levelno = logging.getLevelName(level) if level in LEVELS else logging.INFO
+        if levelno < self.min_level:
+            self.counters["filtered"] += 1
+            return "filtered"
+
+        now = time.monotonic()
+        key = (level, message)
+        if key == self.last_key and now - self.last_time <= self.dedup_window:
+            self.last_time = now
+            self.repeats += 1
+            self.counters["deduplicated"] += 1
+            if self.repeat_timer is None:
+                self.repeat_timer = asyncio.get_running_loop().call_later(self.dedup_window, self.flush_repeats)
+            return "deduplicated"
+
+        self.flush_repeats()
+        self.last_key = key
+        self.last_time = now
+
+        bucket = self.buckets.get(level)
+        if bucket is not None and not bucket.allow(now):
+            self.suppressed[level] += 1
+            self.counters["rate_limited"] += 1
+            if self.suppressed_timer is None:
+                self.suppressed_timer = asyncio.get_running_loop().call_later(1.0, self.flush_suppressed)
+            return "rate_limited"
+
+        self.counters["relayed"] += 1
+        self.emit(level, message)
+
+    def flush(self):
+        """Emit the pending repeat and rate limit summaries now instead of when their timers fire."""
+        self.flush_repeats()
+        if self.suppressed_timer is not None:
+            self.suppressed_timer.cancel()
+            self.flush_suppressed()
+
+    def flush_repeats(self):
+        if self.repeat_timer is not None:
+            self.repeat_timer.cancel()
+            self.repeat_timer = None
+        if self.repeats:
+            level, message = self.last_key
+            self.emit(level, f"{message} (repeated {self.repeats} times)")
+            self.repeats = 0
+
+    def flush_suppressed(self):
+        self.suppressed_timer = None
+        for level, count in self.suppressed.items():
+            if count:
+                self.emit(level, f"rate limit: suppressed {count} {level} messages")
+                self.suppressed[level] = 0
+
+    def collect_metrics(self):
+        return [("core_log_messages_total", "counter", "Core log messages by relay outcome", [({"outcome": name}, count) for name, count in self.counters.items()])]
+
+    def status(self):
+        rates = ", ".join(f"{level}: {bucket.rate:g}/s" if bucket.rate > 0 else f"{level}: unlimited" for level, bucket in self.buckets.items())
+        counters = ", ".join(f"{name}: {count}" for name, count in self.counters.items())
+        return f"Core log minimum level: {logging.getLevelName(self.min_level)}\nRate limits: {rates}\nDedup window: {self.dedup_window:g}s\n{counters}"
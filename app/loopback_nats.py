@@ -0,0 +1,111 @@
+import asyncio
+from urllib.parse import urlparse
+from dunebugger_logging import logger
+
+
+def subject_matches(pattern, subject):
+    """NATS subject matching with '*' (one token) and '>' (one or more trailing tokens)."""
+    pattern_tokens = pattern.split(".")
+    subject_tokens = subject.split(".")
+    for index, token in enumerate(pattern_tokens):
+        if token == ">":
+            return len(subject_tokens) > index
+        if index >= len(subject_tokens) or (token != "*" and token != subject_tokens[index]):
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+
+class LoopbackMsg:
+    __slots__ = ("subject", "data", "reply", "headers")
+
+    def __init__(self, subject, data, reply="", headers=None):
+        self.subject = subject
+        self.data = data
+        self.reply = reply
+        self.headers = headers
+
+
+class LoopbackSubscription:
+    """Delivers matching messages to its callback one at a time, like a NATS subscription."""
+
+    def __init__(self, subject, cb):
+        self.subject = subject
+        self.cb = cb
+        self.pending = asyncio.Queue()
+        self.task = asyncio.create_task(self._deliver())
+
+    async def _deliver(self):
+        while True:
+            msg = await self.pending.get()
+            try:
+                await self.cb(msg)
+            except Exception as e:
+                logger.error(f"Error in loopback subscription callback: {e}")
+            finally:
+                self.pending.task_done()
+
+    async def drain(self):
+        """Deliver the messages already pending, then stop."""
+        await self.pending.join()
+        await self.unsubscribe()
+
+    async def unsubscribe(self):
+        self.task.cancel()
+
+
+class LoopbackNATS:
+    """In-process stand-in for nats.aio.client.Client, used with 'loopback://' servers.
+
+    Implements the subset of the client API NATSComm uses. Published messages are delivered
+    to local subscriptions, and on_publish(msg) lets a simulated core react to commands.
+    """
+
+    def __init__(self):
+        self.is_connected = False
+        self.connected_url = None
+        self.subscriptions = []
+        self.on_publish = None
+        self.on_connect = None
+        self.published = 0
+
+    async def connect(self, servers=None, **options):
+        server = servers[0] if isinstance(servers, list) else servers
+        self.connected_url = urlparse(server or "loopback://local")
+        self.is_connected = True
+
+    async def subscribe(self, subject, queue="", cb=None, **options):
+        subscription = LoopbackSubscription(subject, cb)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    # Same signatures as nats.aio.client.Client, so calls that work here work against a server
+    async def publish(self, subject, payload=b"", reply="", headers=None):
+        if not self.is_connected:
+            raise ConnectionError("loopback client not connected")
+        msg = LoopbackMsg(subject, payload, reply, headers)
+        self.published += 1
+        self.deliver(msg)
+        if self.on_publish is not None:
+            self.on_publish(msg)
+
+    def deliver(self, msg):
+        """Hand a message to every matching subscription, as if it came from the server."""
+        for subscription in self.subscriptions:
+            if subject_matches(subscription.subject, msg.subject):
+                subscription.pending.put_nowait(msg)
+
+    async def flush(self, timeout=10):
+        await asyncio.sleep(0)
+
+    async def drain(self):
+        # Like NATS: no new messages, but those already received are still delivered
+        subscriptions, self.subscriptions = self.subscriptions, []
+        for subscription in subscriptions:
+            await subscription.drain()
+        await self.close()
+
+    async def close(self):
+        for subscription in self.subscriptions:
+            await subscription.unsubscribe()
+        self.subscriptions = []
+        self.is_connected = False
@@ -1,28 +1,146 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
+import os
+import signal
+import sys
+from startup_timing import startup_timer  # imported first so startup timings start here
 
-# from dunebugger_settings import settings
-from class_factory import terminal_interpreter, mqueue
+from dunebugger_settings import settings
+import class_factory  # components are built on first access, see class_factory
+from batch_runner import BatchRunner
+from session_recorder import SessionRecorder, SessionReplayer
+from terminal_daemon import TerminalDaemon, DaemonClient, resolve_socket_path
+from utils import positive_int
 
+startup_timer.mark("imports")
 
-async def main():
+
+def positive_int_argument(text):
+    try:
+        return positive_int(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dunebugger terminal")
+    parser.add_argument("--script", metavar="FILE", help="run the commands in FILE (one or more ';'-separated per line) and exit; piped stdin is run the same way")
+    parser.add_argument("--window", type=positive_int_argument, default=8, help="max commands waiting for a reply at the same time in script mode (default: 8)")
+    parser.add_argument("--connect-timeout", type=float, default=30, help="seconds to wait for the NATS connection in script mode (default: 30)")
+    parser.add_argument("--daemon", action="store_true", help="run headless, sharing one NATS connection with the terminals attached to daemonSocket")
+    parser.add_argument("--record", metavar="FILE", help="append every inbound message to the session recording FILE")
+    parser.add_argument("--replay", metavar="FILE", help="replay the session recording FILE through the message handlers and exit, without connecting")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier, 0 for as fast as possible (default: 1)")
+    parser.add_argument("--profile-startup", action="store_true", help="print how long each import and initialization step took once the terminal is ready")
+    return parser.parse_args()
+
+
+def report_startup(args, stage):
+    """Mark the point where this mode is ready for use, printing the breakdown if asked to."""
+    startup_timer.mark(stage)
+    if args.profile_startup:
+        print(startup_timer.breakdown())
+
+
+async def run_batch(args, connection):
+    if not await connection.wait_until_ready(args.connect_timeout):
+        print(f"NATS connection not ready after {args.connect_timeout:g}s")
+        return False
+    report_startup(args, "connected")
+    runner = BatchRunner(class_factory.mqueue_handler, window=args.window)
+    if args.script:
+        with open(args.script) as script:
+            return await runner.run(script)
+    return await runner.run(sys.stdin)
+
+
+async def attach_daemon():
+    """Return a DaemonClient connected to a running daemon, or None to connect directly."""
+    socket_path = resolve_socket_path(settings.daemonSocket)
+    if socket_path is None or not os.path.exists(socket_path):
+        return None
+    mqueue_handler = class_factory.mqueue_handler
+    client = DaemonClient(socket_path, mqueue_handler, class_factory.outbound_buffer, class_factory.inbound_dispatcher)
+    if not await client.connect():
+        return None
+    mqueue_handler.mqueue_sender = client
+    return client
+
+
+async def run_daemon(args):
+    socket_path = resolve_socket_path(settings.daemonSocket)
+    if socket_path is None:
+        return 1
+    daemon = TerminalDaemon(class_factory.mqueue, socket_path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    if not await daemon.start():
+        return 1
+    report_startup(args, "daemon listening")
     try:
-        await mqueue.start_listener()
-        # wait that NATS is connected before continuing
-        while not mqueue.is_connected:
-            await asyncio.sleep(1)
-        await terminal_interpreter.request_commands_list()
+        await stop.wait()
+    finally:
+        await daemon.stop()
+    return 0
+
+
+async def run_replay(args):
+    replayer = SessionReplayer(class_factory.mqueue_handler.process_mqueue_message, speed=args.speed)
+    report_startup(args, "replay ready")
+    elapsed = await replayer.run(args.replay)
+    # The relay's summaries are due after the last message, don't exit without them
+    class_factory.terminal_interpreter.core_log_relay.flush()
+    print(replayer.summary(elapsed))
+    return 0
+
+
+async def main(args):
+    if args.replay:
+        # A replayed commands_list must not replace the cached one of the real core
+        settings.commandsCacheFile = ""
+    # The daemon only relays messages, everything else renders them in this terminal
+    if not args.daemon:
+        terminal_interpreter = class_factory.terminal_interpreter
+        terminal_interpreter.profile_startup = args.profile_startup
+    if args.replay:
+        return await run_replay(args)
+    connection = None if args.daemon or args.record else await attach_daemon()
+    connection = connection or class_factory.mqueue
+    if args.record:
+        connection.recorder = SessionRecorder(args.record)
+
+    metrics_writer = class_factory.metrics_writer
+    config_watcher = class_factory.config_watcher
+    try:
+        await connection.start_listener()
+        metrics_writer.start()
+        config_watcher.start()
+        if args.daemon:
+            return await run_daemon(args)
+        if args.script or not sys.stdin.isatty():
+            return 0 if await run_batch(args, connection) else 1
+
+        # The prompt starts right away using the cached commands list, refreshed from
+        # the core once NATS is connected; commands typed meanwhile are queued for delivery
+        revalidate_task = asyncio.create_task(terminal_interpreter.revalidate_commands_list(connection))
         await terminal_interpreter.terminal_listen()
-    
+        revalidate_task.cancel()
+        return 0
+
     finally:
         # Clean up resources when exiting
         print("Cleaning up resources...")
-        
+
         # Close NATS connection
-        await mqueue.close_listener()
- 
+        await config_watcher.stop()
+        await connection.close_listener()
+        await metrics_writer.stop()
+
         print("Cleanup completed.")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,183 @@
+import re
+import time
+from collections import deque
+
+
+def describe(subject, body):
+    """Return (level, text) summarizing an inbound message body for the history."""
+    try:
+        if subject in ("log_message", "terminal_command_reply"):
+            return str(body.get("level") or "INFO").upper(), str(body.get("message", ""))
+        if subject == "show_gpio_status":
+            return None, f"GPIO status of {len(body)} pins"
+        if subject == "show_configuration":
+            return None, f"configuration of {sum(len(setting) for setting in body)} settings"
+        if subject == "commands_list":
+            return None, f"{len(body)} commands"
+    except (AttributeError, TypeError):
+        pass
+    return None, str(body)
+
+
+def parse_time(text, now=None):
+    """Parse '90s', '15m', '2h' (ago) or 'HH:MM[:SS]' (today) into an epoch timestamp."""
+    now = now or time.time()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if text[-1:] in units and text[:-1].replace(".", "", 1).isdigit():
+        return now - float(text[:-1]) * units[text[-1]]
+    parts = [int(part) for part in text.split(":")]
+    if not 2 <= len(parts) <= 3:
+        raise ValueError(f"invalid time '{text}', use 15m, 2h or HH:MM[:SS]")
+    hours, minutes, seconds = (parts + [0])[:3]
+    today = time.localtime(now)
+    return time.mktime((today.tm_year, today.tm_mon, today.tm_mday, hours, minutes, seconds, 0, 0, -1))
+
+
+def describe_payload(data, max_text):
+    """Summarize a payload that was not decoded: its start if it is text, its size otherwise."""
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return str(data)
+    text = bytes(data[: max_text + 1]).decode("utf-8", "replace")
+    # A character cut at the end is expected, a replacement character before it means binary
+    if "\ufffd" in text.rstrip("\ufffd"):
+        return f"{len(data)} bytes"
+    return text
+
+
+class HistoryRecord:
+    __slots__ = ("seq", "timestamp", "subject", "level", "text", "note")
+
+    def __init__(self, seq, timestamp, subject, level, text, note=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.subject = subject
+        self.level = level
+        self.text = text
+        self.note = note  # why the message was not shown, e.g. "unhandled" or "rate_limited"
+
+    def format(self):
+        clock = time.strftime("%H:%M:%S", time.localtime(self.timestamp))
+        note = f" [{self.note}]" if self.note else ""
+        return f"{clock}.{int(self.timestamp % 1 * 1000):03d} {self.subject:<22} {self.level or '-':<8} {self.text}{note}"
+
+
+class MessageHistory:
+    """Fixed-size ring buffer of inbound messages, indexed by subject and level.
+
+    Records are numbered with a growing sequence number; record seq lives in slot
+    seq % capacity, and the per-subject and per-level indexes hold the sequence numbers
+    of live records in arrival order. Texts longer than max_text are truncated, so memory
+    is bounded by capacity * max_text. Every inbound message is recorded on arrival, those
+    that were then not shown carry a note saying why.
+    """
+
+    def __init__(self, capacity=5000, max_text=500):
+        self.capacity = capacity
+        self.max_text = max_text
+        self.records = [None] * capacity
+        self.next_seq = 0
+        self.by_subject = {}
+        self.by_level = {}
+
+    def __len__(self):
+        return min(self.next_seq, self.capacity)
+
+    @property
+    def first_seq(self):
+        return max(0, self.next_seq - self.capacity)
+
+    def add(self, subject, body, timestamp=None):
+        """Record a decoded message body; returns its HistoryRecord."""
+        if subject == "log_message" and isinstance(body, dict):
+            # Most inbound traffic, so spare it the general describe()
+            level = body.get("level") or "INFO"
+            level = (level if isinstance(level, str) else str(level)).upper()
+            text = body.get("message", "")
+            if not isinstance(text, str):
+                text = str(text)
+        else:
+            level, text = describe(subject, body)
+        return self.record(subject, level, text, timestamp)
+
+    def record(self, subject, level, text, timestamp=None, note=None):
+        """Store an already summarized message, e.g. one that was not decoded; returns its HistoryRecord."""
+        if len(text) > self.max_text:
+            text = text[: self.max_text] + "..."
+        seq = self.next_seq
+        self.next_seq = seq + 1
+        records = self.records
+        slot = seq % self.capacity
+        evicted = records[slot]
+        if evicted is not None:
+            # The evicted record is the oldest, so it is at the head of its index entries
+            self.by_subject[evicted.subject].popleft()
+            if evicted.level is not None:
+                self.by_level[evicted.level].popleft()
+
+        record = records[slot] = HistoryRecord(seq, timestamp or time.time(), subject, level, text, note)
+        # Called for every inbound message: indexes that exist already are the common case
+        try:
+            self.by_subject[subject].append(seq)
+        except KeyError:
+            self.by_subject[subject] = deque((seq,))
+        if level is not None:
+            try:
+                self.by_level[level].append(seq)
+            except KeyError:
+                self.by_level[level] = deque((seq,))
+        return record
+
+    def _candidates(self, subject=None, level=None, start_seq=0, reverse=False):
+        """Yield matching records from start_seq on, walking the smallest applicable index."""
+        indexes = []
+        if subject is not None:
+            indexes.append(self.by_subject.get(subject, ()))
+        if level is not None:
+            indexes.append(self.by_level.get(level.upper(), ()))
+        if indexes:
+            seqs = min(indexes, key=len)
+        else:
+            seqs = range(max(start_seq, self.first_seq), self.next_seq)
+        if reverse:
+            seqs = reversed(seqs)
+        for seq in seqs:
+            if seq < start_seq:
+                continue
+            record = self.records[seq % self.capacity]
+            if (subject is None or record.subject == subject) and (level is None or record.level == level.upper()):
+                yield record
+
+    def _seq_at(self, timestamp):
+        """Return the first sequence number of a record at or after timestamp."""
+        low, high = self.first_seq, self.next_seq
+        while low < high:
+            middle = (low + high) // 2
+            if self.records[middle % self.capacity].timestamp < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def tail(self, count=20, subject=None, level=None):
+        records = []
+        for record in self._candidates(subject, level, reverse=True):
+            if len(records) >= count:
+                break
+            records.append(record)
+        return records[::-1]
+
+    def grep(self, pattern, subject=None, level=None):
+        regex = re.compile(pattern, re.IGNORECASE)
+        return [record for record in self._candidates(subject, level) if regex.search(record.text)]
+
+    def since(self, start, end=None, subject=None, level=None):
+        records = []
+        for record in self._candidates(subject, level, self._seq_at(start)):
+            if end is not None and record.timestamp > end:
+                break
+            records.append(record)
+        return records
+
+    def status(self):
+        subjects = ", ".join(f"{subject}: {len(seqs)}" for subject, seqs in sorted(self.by_subject.items()))
+        return f"History: {len(self)} of {self.capacity} messages ({subjects or 'empty'})"
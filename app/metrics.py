@@ -0,0 +1,186 @@
+import asyncio
+import bisect
+import os
+from dunebugger_logging import logger
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class NullInstrument:
+    """Returned while metrics are disabled, so instrumented code costs a no-op call."""
+
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL_INSTRUMENT = NullInstrument()
+
+
+class MetricsRegistry:
+    """Counters and histograms keyed by name and labels, exportable in Prometheus text format.
+
+    Components with their own counters (queues, buffers, trackers) contribute through
+    collectors: callables returning [(name, type, help, [(labels dict, value), ...]), ...].
+    """
+
+    def __init__(self, enabled=True, prefix="dunebugger_terminal"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.metrics = {}
+        self.help = {}
+        self.collectors = []
+
+    def counter(self, name, help="", **labels):
+        if not self.enabled:
+            return NULL_INSTRUMENT
+        return self._get(name, "counter", help, labels, Counter)
+
+    def histogram(self, name, help="", **labels):
+        if not self.enabled:
+            return NULL_INSTRUMENT
+        return self._get(name, "histogram", help, labels, Histogram)
+
+    def _get(self, name, kind, help, labels, factory):
+        key = (name, tuple(sorted(labels.items())) if len(labels) > 1 else tuple(labels.items()))
+        instrument = self.metrics.get(key)
+        if instrument is None:
+            instrument = self.metrics[key] = factory()
+            self.help.setdefault(name, (kind, help))
+        return instrument
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _collected(self):
+        for collector in self.collectors:
+            try:
+                yield from collector()
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+
+    def render_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        by_name = {}
+        for (name, labels), instrument in self.metrics.items():
+            by_name.setdefault(name, []).append((labels, instrument))
+
+        for name, series in sorted(by_name.items()):
+            kind, help = self.help[name]
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, instrument in series:
+                if kind == "counter":
+                    lines.append(f"{full_name}{_format_labels(labels)} {instrument.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(instrument.buckets) + ["+Inf"], instrument.counts):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {instrument.sum}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {instrument.count}")
+
+        for name, kind, help, samples in self._collected():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{full_name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Return a human readable summary of all metrics for the stats command."""
+        if not self.enabled:
+            return "Metrics are disabled (metricsEnabled = False)"
+        lines = []
+        for (name, labels), instrument in sorted(self.metrics.items()):
+            if isinstance(instrument, Counter):
+                lines.append(f"{name}{_format_labels(labels)}: {instrument.value}")
+            else:
+                average = instrument.sum / instrument.count * 1000 if instrument.count else 0.0
+                lines.append(f"{name}{_format_labels(labels)}: count {instrument.count}, avg {average:.3f} ms")
+        for name, _, _, samples in self._collected():
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))}: {value:g}")
+        return "\n".join(lines) if lines else "No metrics recorded yet"
+
+
+class PrometheusTextfileWriter:
+    """Periodically writes the registry to a .prom file for node_exporter's textfile collector."""
+
+    def __init__(self, registry, textfile, interval=15):
+        self.registry = registry
+        self.textfile = textfile
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        if self.registry.enabled and self.textfile and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            self.write(self.registry.render_prometheus())
+
+    def write(self, text):
+        # Write to a temporary file and rename, so node_exporter never reads a partial file
+        try:
+            temp_file = f"{self.textfile}.tmp"
+            with open(temp_file, "w") as textfile:
+                textfile.write(text)
+            os.replace(temp_file, self.textfile)
+        except OSError as e:
+            logger.error(f"Error writing metrics to {self.textfile}: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            await loop.run_in_executor(None, self.write, self.registry.render_prometheus())
+
+
+metrics = MetricsRegistry()
@@ -1,29 +1,89 @@
-from nats.aio.client import Client as NATS
-import json
 import asyncio
+import time
+from collections import deque
 from dunebugger_logging import logger
+from metrics import metrics
+from startup_timing import startup_timer
+from utils import backoff_delay, wait_for_event
+
+
+class SwitchoverFilter:
+    """Drops the second copy of messages received on both connections while switching servers.
+
+    Both subscriptions are live until the old connection is drained, so a message published
+    in that window arrives twice when the old and new servers are in the same cluster. Copies
+    are paired one to one, so a message the core really sends twice is still delivered twice,
+    and a copy must arrive within max_delay seconds of the message it pairs with: anything
+    older was not seen on both connections, e.g. because the servers are not clustered or
+    it came before the new subscription, and a repeat of it is a message of its own.
+    """
+
+    def __init__(self, old_nc, new_nc, max_delay=0.5):
+        self.seen = {old_nc: {}, new_nc: {}}  # message -> arrival times of unpaired copies
+        self.max_delay = max_delay
+        self.dropped = 0
+
+    def is_duplicate(self, nc, mqueue_message):
+        now = time.monotonic()
+        key = (mqueue_message.subject, mqueue_message.data)
+        for other, unpaired in self.seen.items():
+            if other is nc:
+                continue
+            arrivals = unpaired.get(key)
+            while arrivals and now - arrivals[0] > self.max_delay:
+                arrivals.popleft()
+            if arrivals:
+                arrivals.popleft()
+                self.dropped += 1
+                return True
+        arrivals = self.seen[nc].get(key)
+        if arrivals is None:
+            arrivals = self.seen[nc][key] = deque()
+        arrivals.append(now)
+        return False
 
 
 class NATSComm:
-    def __init__(self, nat_servers, client_id, subject_root, mqueue_handler):
-        self.nc = NATS()
+    def __init__(self, nat_servers, client_id, subject_root, mqueue_handler, outbound_buffer, inbound_dispatcher, nats_client=None):
+        if nats_client is None:
+            from nats.aio.client import Client as NATS
+
+            nats_client = NATS()
+        self.nc = nats_client
         self.servers = nat_servers
         self.client_id = client_id
         self.subject_root = subject_root
         self.mqueue_handler = mqueue_handler
         self.is_connected = False
         self.connection_task = None
-        self.retry_interval = 10  # seconds between connection attempts
+        self.retry_interval = 10  # max seconds between connection attempts
+        self.retry_initial = 0.5  # seconds before the first retry, doubled on each failure
+        self.ready = asyncio.Event()  # set while connected and subscribed
+        self.on_ready_change = None  # called with the new readiness when it changes
+        self.outbound_buffer = outbound_buffer
+        self.outbound_buffer.on_discard = self.mqueue_handler.message_discarded
+        self.inbound_dispatcher = inbound_dispatcher
+        self.inbound_dispatcher.process = self._process_message
+        self.recorder = None  # SessionRecorder appending inbound messages, if recording
+        self.switch_lock = asyncio.Lock()  # held while connecting, so a server switch doesn't interleave
+        self.switchover = None  # SwitchoverFilter while the previous connection is drained
+        self.switchover_grace = 1.0  # seconds the filter outlives the drain, for late copies on the new connection
 
         self.nc.on_connect = lambda nc: logger.info(f"Connected to NATS messaging server: {self.servers}")
 
     async def disconnected_cb(self):
         self.is_connected = False
+        self.mqueue_handler.codec.reset_advertised()
+        self._set_ready(False)
+        metrics.counter("disconnects_total", "Disconnections from the NATS server").inc()
         logger.warning("Disconnected from NATS messaging server")
 
     async def reconnected_cb(self):
         self.is_connected = True
+        metrics.counter("reconnects_total", "Reconnections to the NATS server").inc()
         logger.info(f"Got reconnected to {self.nc.connected_url.netloc}")
+        self._set_ready(True)
+        await self.replay_outbound()
 
     async def error_cb(self, error):
         logger.error(f"Error occurred: {error}")
@@ -42,52 +102,160 @@ class NATSComm:
             if self.nc.is_connected:
                 await self.nc.drain()
                 logger.debug("NATS connection closed")
+
+            await self.inbound_dispatcher.stop()
+            if self.recorder is not None:
+                self.recorder.close()
         except Exception as e:
             logger.error(f"Error closing NATS connection: {e}")
 
-    async def connect(self):
+    async def connect(self, nc=None, servers=None):
+        nc = nc or self.nc
         try:
-            await self.nc.connect(
-                servers=self.servers,
+            await nc.connect(
+                servers=servers or self.servers,
                 name=self.client_id,
                 ping_interval=5,
                 max_outstanding_pings=3,
                 reconnect_time_wait=10,
-                reconnected_cb=self.reconnected_cb,
-                disconnected_cb=self.disconnected_cb,
+                reconnected_cb=self._current_only(nc, self.reconnected_cb),
+                disconnected_cb=self._current_only(nc, self.disconnected_cb),
                 error_cb=self.error_cb,
                 max_reconnect_attempts=-1,  # Unlimited reconnect attempts
             )
-            self.is_connected = True
+            if nc is self.nc:
+                self.is_connected = True
             return True
         except Exception as e:
-            self.is_connected = False
+            if nc is self.nc:
+                self.is_connected = False
             logger.debug(f"Failed to connect to NATS: {e}")
             return False
 
+    def _current_only(self, nc, callback):
+        """Wrap a connection callback so events of a client already switched away from are ignored."""
+
+        async def current_only():
+            if nc is self.nc:
+                await callback()
+
+        return current_only
+
+    async def _subscribe(self, nc):
+        async def receive(mqueue_message):
+            if self.switchover is not None and self.switchover.is_duplicate(nc, mqueue_message):
+                return
+            await self._handler(mqueue_message)
+
+        await nc.subscribe(f"{self.subject_root}.{self.client_id}.*", cb=receive)
+        await nc.flush()
+
+    async def switch_servers(self, servers):
+        """Move to other NATS servers without losing the connection or replies on their way.
+
+        A second client connects and subscribes to the new servers, takes over publishing,
+        and only then is the previous client drained, so messages it already received are
+        still processed. If the new servers can't be reached the current connection is kept.
+        """
+        async with self.switch_lock:
+            old_nc = self.nc
+            new_nc = type(old_nc)()
+            logger.info(f"Switching NATS servers from {self.servers} to {servers}")
+            connected = await self.connect(new_nc, servers)
+            if connected:
+                # Pair copies from when the new subscription starts, nothing before has one
+                self.switchover = SwitchoverFilter(old_nc, new_nc)
+                try:
+                    await self._subscribe(new_nc)
+                except Exception as e:
+                    logger.error(f"Failed to subscribe to messaging queue on {servers}: {e}")
+                    await new_nc.close()
+                    self.switchover = None
+                    connected = False
+            if not connected and self.is_connected:
+                logger.error(f"Could not connect to NATS servers {servers}, staying on {self.servers}")
+                return False
+
+            self.nc, self.servers = new_nc, servers
+            self.mqueue_handler.codec.reset_advertised()
+            try:
+                if connected:
+                    self.is_connected = True
+                    self._set_ready(True)
+                    await self.replay_outbound()
+                if old_nc.is_connected:
+                    await old_nc.drain()
+                else:
+                    await old_nc.close()
+            except Exception as e:
+                logger.debug(f"Error closing the previous NATS connection: {e}")
+            finally:
+                if self.switchover is not None:
+                    asyncio.get_running_loop().call_later(self.switchover_grace, self._end_switchover, self.switchover)
+
+        if not connected:
+            # Not connected before either: the connection loop keeps trying the new servers
+            logger.warning(f"Could not connect to NATS servers {servers} yet, retrying in the background")
+            return False
+        metrics.counter("server_switches_total", "Switches to other NATS servers").inc()
+        logger.info(f"Switched to NATS servers {servers}")
+        return True
+
+    def _end_switchover(self, switchover):
+        if self.switchover is switchover:
+            self.switchover = None
+        if switchover.dropped:
+            logger.info(f"Dropped {switchover.dropped} duplicate messages received during the NATS server switch")
+
+    def _set_ready(self, ready):
+        if ready == self.ready.is_set():
+            return
+        if ready:
+            self.ready.set()
+        else:
+            self.ready.clear()
+        if self.on_ready_change is not None:
+            self.on_ready_change(ready)
+
+    def _retry_delay(self, attempt):
+        """Exponential backoff with jitter, capped at retry_interval."""
+        return backoff_delay(attempt, self.retry_initial, self.retry_interval)
+
     async def _connection_loop(self):
         """Background task that continuously tries to establish NATS connection"""
+        attempt = 0
         while True:
             try:
                 if not self.is_connected:
                     logger.debug("Attempting to connect to NATS messaging server...")
-                    success = await self.connect()
-                    if success:
-                        logger.info(f"Connected to NATS messaging server: {self.servers}")
-                        # Subscribe to messages once connected
-                        try:
-                            await self.nc.subscribe(f"{self.subject_root}.{self.client_id}.*", cb=self._handler)
-                            await self.nc.flush()
-                            logger.info(f"Listening for messages on queue {self.subject_root}.{self.client_id}.")
-                        except Exception as e:
-                            logger.error(f"Failed to subscribe to messaging queue: {e}")
-                            self.is_connected = False
-                    else:
-                        logger.debug(f"Connection failed, retrying in {self.retry_interval} seconds...")
-                        
-                # Wait before next connection attempt or status check
+                    async with self.switch_lock:
+                        success = await self.connect()
+                        if success:
+                            startup_timer.mark("connect")
+                            logger.info(f"Connected to NATS messaging server: {self.servers}")
+                            # Subscribe to messages once connected
+                            try:
+                                await self._subscribe(self.nc)
+                                startup_timer.mark("subscribe")
+                                logger.info(f"Listening for messages on queue {self.subject_root}.{self.client_id}.")
+                                attempt = 0
+                                self._set_ready(True)
+                                await self.replay_outbound()
+                            except Exception as e:
+                                logger.error(f"Failed to subscribe to messaging queue: {e}")
+                                self.is_connected = False
+
+                    if not self.is_connected:
+                        delay = self._retry_delay(attempt)
+                        attempt += 1
+                        logger.debug(f"Connection failed, retrying in {delay:.1f} seconds...")
+                        self.outbound_buffer.expire()
+                        await asyncio.sleep(delay)
+                        continue
+
+                # Connected: periodic status check
                 await asyncio.sleep(self.retry_interval)
-                
+
             except asyncio.CancelledError:
                 logger.debug("Connection loop cancelled")
                 break
@@ -96,6 +264,12 @@ class NATSComm:
                 await asyncio.sleep(self.retry_interval)
 
     async def _handler(self, mqueue_message):
+        if self.recorder is not None:
+            self.recorder.record(mqueue_message)
+        # Only enqueue here: the dispatcher workers process messages by subject priority
+        self.inbound_dispatcher.put(mqueue_message)
+
+    async def _process_message(self, mqueue_message):
         try:
             command_reply_message = await self.mqueue_handler.process_mqueue_message(mqueue_message)
             if command_reply_message:
@@ -109,27 +283,70 @@ class NATSComm:
     async def start_listener(self):
         """Start the non-blocking NATS connection process"""
         logger.info("Starting NATS connection manager (non-blocking)")
+        self.inbound_dispatcher.start()
         self.connection_task = asyncio.create_task(self._connection_loop())
         return self.connection_task
 
+    async def wait_until_ready(self, timeout=None):
+        """Wait until the connection is established and the subscription is active.
+
+        Returns False if timeout (seconds) expires first."""
+        return await wait_for_event(self.ready, timeout)
+
     def get_connection_status(self):
         """Return current connection status"""
         return self.is_connected
 
+    async def replay_outbound(self):
+        """Publish the messages queued while disconnected, then flush them in one go."""
+        entries = self.outbound_buffer.drain()
+        if not entries:
+            return
+
+        published = []
+        try:
+            for entry in entries:
+                if entry.reply_subject:
+                    await self.nc.publish(entry.subject, entry.payload, reply=entry.reply_subject, headers=entry.headers)
+                else:
+                    await self.nc.publish(entry.subject, entry.payload, headers=entry.headers)
+                published.append(entry)
+            await self.nc.flush()
+        except Exception as e:
+            logger.error(f"Error replaying queued messages: {e}")
+            self.outbound_buffer.requeue(entries[len(published) :])
+
+        self.outbound_buffer.replayed += len(published)
+        for entry in published:
+            # Entry subjects are <root>.<recipient>.<type>
+            self.mqueue_handler.codec.published(entry.subject.rsplit(".", 2)[-2], entry.headers)
+            self.mqueue_handler.message_published(entry.message)
+        stats = self.outbound_buffer.get_stats()
+        logger.info(f"Replayed {len(published)} queued messages (dropped: {stats['dropped']}, expired: {stats['expired']}, coalesced: {stats['coalesced']})")
+
     async def send(self, message: dict, recipient, reply_subject=None):
+        """Publish a message. Returns True once published; while disconnected the message is queued for replay and False is returned."""
+        # Encode with the codec negotiated with the recipient, JSON unless it advertised others
+        subject = f"{self.subject_root}.{recipient}.{message['subject']}"
+        payload, headers = self.mqueue_handler.codec.encode(message, recipient)
+
         if not self.is_connected:
-            logger.warning("NATS not connected, cannot send message")
+            if self.outbound_buffer.push(subject, payload, reply_subject, message, headers):
+                logger.warning(f"NATS not connected, message queued for delivery ({len(self.outbound_buffer)} queued)")
             return False
-            
+
         try:
-            # Convert dictionary to JSON string, then encode to bytes
-            subject = message["subject"]
-            message_json = json.dumps(message)
+            start = time.perf_counter()
             if reply_subject:
-                await self.nc.publish(f"{self.subject_root}.{recipient}.{subject}", message_json.encode(), reply_to=reply_subject)
+                await self.nc.publish(subject, payload, reply=reply_subject, headers=headers)
             else:
-                await self.nc.publish(f"{self.subject_root}.{recipient}.{subject}", message_json.encode())
+                await self.nc.publish(subject, payload, headers=headers)
+            if metrics.enabled:
+                metrics.histogram("publish_seconds", "Time spent publishing a message").observe(time.perf_counter() - start)
+            self.mqueue_handler.codec.published(recipient, headers)
             return True
         except Exception as e:
-            logger.error(f"Error sending message: {e}")
+            metrics.counter("publish_failures_total", "Messages that failed to publish").inc()
+            logger.error(f"Error sending message, queueing it for delivery: {e}")
+            self.outbound_buffer.push(subject, payload, reply_subject, message, headers)
             return False
@@ -1,7 +1,18 @@
 import asyncio
-import json
+import time
+import json_backend
+import payload_codec
+from payload_codec import PayloadCodec
+from message_history import MessageHistory, describe_payload
+from reply_assembler import ReplyAssembler
 from dunebugger_logging import logger
 from dunebugger_settings import settings
+from request_tracker import RequestTracker, COMMAND_REPLY_SUBJECTS, REPLY_SUBJECTS
+from utils import parse_subject
+from metrics import metrics, NULL_INSTRUMENT
+
+# Time the reply handler of one inbound message in this many, per subject
+HANDLER_TIMING_SAMPLE = 64
 
 
 class MessagingQueueHandler:
@@ -10,40 +21,174 @@ class MessagingQueueHandler:
     def __init__(self):
         self.mqueue_sender = None
         self.terminal_interpreter = None
+        self.request_tracker = RequestTracker(timeout=settings.mQueueReplyTimeout)
+        self.skipped_messages = 0
+        self.known_sources = set()
+        self.reply_assembler = ReplyAssembler(timeout=settings.chunkTimeout, on_timeout=self.chunks_timed_out)
+        self.history = MessageHistory(capacity=settings.historyCapacity, max_text=settings.historyMaxText)
+        self.codec = PayloadCodec(
+            preferred=settings.payloadCodec, codec_threshold=settings.payloadCodecThreshold, compress_threshold=settings.payloadCompressThreshold
+        )
+        self._unhandled_subjects = set()
+        self._subject_metrics = {}
 
     async def process_mqueue_message(self, mqueue_message):
         """Callback method to process received messages."""
-        # Parse the JSON string back into a dictionary
         try:
-            data = mqueue_message.data.decode()
-            message_json = json.loads(data)
-        except (AttributeError, UnicodeDecodeError) as decode_error:
-            logger.error(f"Failed to decode message data: {decode_error}. Raw message: {mqueue_message.data}")
+            subject = parse_subject(mqueue_message.subject)
+        except (AttributeError, IndexError) as subject_error:
+            metrics.counter("decode_errors_total", "Inbound messages that could not be decoded", kind="subject").inc()
+            logger.error(f"Invalid message subject: {subject_error}. Subject: {getattr(mqueue_message, 'subject', None)}")
             return
-        except json.JSONDecodeError as json_error:
-            logger.error(f"Failed to parse message as JSON: {json_error}. Raw message: {data}")
+
+        received, handler_seconds = self._metrics_for(subject)
+        received.inc()
+
+        # Don't pay for decoding messages nobody is going to handle
+        handler = self.terminal_interpreter.reply_handlers.get(subject)
+        if handler is None:
+            self.history.record(subject, None, describe_payload(mqueue_message.data, self.history.max_text), note="unhandled")
+            self.skipped_messages += 1
+            metrics.counter("messages_skipped_total", "Inbound messages without a handler").inc()
+            if subject not in self._unhandled_subjects:
+                self._unhandled_subjects.add(subject)
+                logger.warning(f"Unknown subject in reply: {subject}")
+            return
+
+        # Decode the payload back into a dictionary, JSON unless its header names another codec
+        headers = getattr(mqueue_message, "headers", None)
+        try:
+            message_json = payload_codec.decode(mqueue_message.data, headers)
+        except (AttributeError, TypeError, UnicodeDecodeError) as decode_error:
+            metrics.counter("decode_errors_total", "Inbound messages that could not be decoded", kind="decode").inc()
+            self.history.record(subject, None, describe_payload(getattr(mqueue_message, "data", None), self.history.max_text), note="undecodable")
+            logger.error(f"Failed to decode message data: {decode_error}. Raw message: {getattr(mqueue_message, 'data', None)}")
+            return
+        except payload_codec.CodecError as codec_error:
+            metrics.counter("decode_errors_total", "Inbound messages that could not be decoded", kind="codec").inc()
+            self.history.record(subject, None, describe_payload(mqueue_message.data, self.history.max_text), note="undecodable")
+            logger.error(f"Failed to decode message payload: {codec_error}. Headers: {headers}")
+            return
+        except json_backend.JSONDecodeError as json_error:
+            metrics.counter("decode_errors_total", "Inbound messages that could not be decoded", kind="json").inc()
+            self.history.record(subject, None, describe_payload(mqueue_message.data, self.history.max_text), note="undecodable")
+            logger.error(f"Failed to parse message as JSON: {json_error}. Raw message: {mqueue_message.data}")
             return
 
         try:
-            subject = (mqueue_message.subject).split(".")[2]
             #TODO: too much verbose logging, uncomment if needed
             #logger.debug(f"Processing message: {str(message_json)[:20]}. Subject: {subject}. Reply to: {mqueue_message.reply}")
             reply = message_json["body"]
-            return await self.terminal_interpreter.terminal_handle_reply(subject, reply)
+            record = self.history.add(subject, reply)
+            source = message_json.get("source")
+            if source is not None:
+                self.known_sources.add(source)
+                if headers:
+                    self.codec.learn(source, headers)
+            if message_json.get("total", 1) > 1:
+                return await self.process_chunk(subject, message_json, source)
+            if subject in REPLY_SUBJECTS:
+                pending = self.request_tracker.resolve(subject, reply, message_json.get("correlation_id"), source)
+                if pending is not None and pending.quiet:
+                    record.note = "quiet"
+                    return
+            if not reply:
+                logger.warning("No reply message received.")
+                return
+            # The handler is called directly rather than through terminal_handle_reply, which
+            # would look it up again in another coroutine. Its time is sampled, timing every
+            # message costs more than most handlers
+            if metrics.enabled and not received.value % HANDLER_TIMING_SAMPLE:
+                start = time.perf_counter()
+                try:
+                    note = handler(reply)
+                finally:
+                    handler_seconds.observe(time.perf_counter() - start)
+            else:
+                note = handler(reply)
+            # Handlers may return why the message was not shown, e.g. a log line the relay held back
+            if note is not None:
+                record.note = note
 
         except KeyError as key_error:
             logger.error(f"KeyError: {key_error}. Message: {message_json}")
         except Exception as e:
             logger.error(f"Error processing message: {e}. Message: {message_json}")
 
-    async def dispatch_message(self, message_body, subject, recipient, reply_subject=None):
+    async def process_chunk(self, subject, message_json, source):
+        """Reassemble a chunked reply, rendering chunks as soon as they are in order.
+
+        Subjects without a chunk handler are collected and handled once complete."""
+        key = (subject, message_json.get("stream_id") or message_json.get("correlation_id") or source)
+        stream = self.reply_assembler.streams.get(key)
+        if stream is None:
+            # The first chunk to arrive matches the command, whose future gets the whole reply
+            # once assembled; the assembler times out the rest
+            pending = self.request_tracker.resolve(subject, message_json["body"], message_json.get("correlation_id"), source, complete=False)
+            quiet = pending is not None and pending.quiet
+            stream = self.reply_assembler.open(key, subject, message_json["total"], quiet, self.terminal_interpreter.has_chunk_handler(subject))
+            stream.pending = pending
+
+        for seq, body in self.reply_assembler.add(stream, message_json["seq"], message_json["body"]):
+            if stream.incremental and not stream.quiet:
+                self.terminal_interpreter.handle_reply_chunk(subject, body, seq == 0, seq == stream.total - 1)
+            if stream.incremental and stream.pending is None:
+                continue
+            if stream.assembled is None:
+                stream.assembled = body
+            elif isinstance(body, dict):
+                stream.assembled.update(body)
+            else:
+                stream.assembled.extend(body)
+
+        if stream.next_seq == stream.total:
+            if stream.pending is not None:
+                self.request_tracker.finish(stream.pending, subject, stream.assembled, source)
+            if not stream.incremental and not stream.quiet:
+                return await self.terminal_interpreter.terminal_handle_reply(subject, stream.assembled)
+
+    def chunks_timed_out(self, stream):
+        """Render the chunks of an abandoned reply that arrived after the missing ones."""
+        if stream.pending is not None:
+            self.request_tracker.finish(stream.pending, stream.subject, None)
+        if stream.quiet or not stream.incremental:
+            return
+        for index, seq in enumerate(sorted(stream.chunks)):
+            self.terminal_interpreter.handle_reply_chunk(stream.subject, stream.chunks[seq], index == 0 and stream.next_seq == 0, False)
+
+    def _metrics_for(self, subject):
+        """Per-subject instruments, looked up in the registry once per subject."""
+        instruments = self._subject_metrics.get(subject)
+        if instruments is None or metrics.enabled != (instruments[0] is not NULL_INSTRUMENT):
+            instruments = self._subject_metrics[subject] = (
+                metrics.counter("messages_received_total", "Inbound messages by subject", subject=subject),
+                metrics.histogram("reply_handler_seconds", f"Time spent handling inbound messages, 1 in {HANDLER_TIMING_SAMPLE} sampled", subject=subject),
+            )
+        return instruments
+
+    async def dispatch_message(self, message_body, subject, recipient, reply_subject=None, reply_subjects=COMMAND_REPLY_SUBJECTS, quiet=False):
+        """Send a message stamped with a correlation ID and return the future tracking its reply.
+
+        With quiet=True the reply is only delivered through the future and not rendered."""
+        pending = self.request_tracker.track(message_body, recipient, reply_subjects, quiet=quiet)
         message = {
             "body": message_body,
             "subject": subject,
             "source": settings.mQueueClientID,
+            "correlation_id": pending.correlation_id,
         }
-        await self.mqueue_sender.send(message, recipient, reply_subject)
-
-
+        # A message that is not published right away is either queued for replay or discarded,
+        # and reported back through message_published / message_discarded
+        if await self.mqueue_sender.send(message, recipient, reply_subject):
+            self.request_tracker.mark_sent(pending.correlation_id)
+        return pending.future
 
+    def message_published(self, message):
+        """Called by the sender when a queued message is finally published."""
+        if "correlation_id" in message:
+            self.request_tracker.mark_sent(message["correlation_id"])
 
+    def message_discarded(self, message, reason):
+        """Called by the sender when a message is dropped without being published."""
+        if "correlation_id" in message:
+            self.request_tracker.discard(message["correlation_id"])
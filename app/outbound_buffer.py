@@ -0,0 +1,126 @@
+import json
+import time
+from collections import OrderedDict
+from dunebugger_logging import logger
+
+
+class OutboundEntry:
+    __slots__ = ("subject", "payload", "reply_subject", "message", "headers", "queued_at")
+
+    def __init__(self, subject, payload, reply_subject, message, headers=None):
+        self.subject = subject
+        self.payload = payload
+        self.reply_subject = reply_subject
+        self.message = message
+        self.headers = headers
+        self.queued_at = time.monotonic()
+
+
+class OutboundBuffer:
+    """Bounded, memory-capped queue of messages published while NATS is disconnected.
+
+    Identical messages (same subject and body) are coalesced into one entry, entries older
+    than max_age seconds are expired and the oldest entries are dropped once max_messages or
+    max_bytes is exceeded. Every message leaving the buffer without being published is
+    reported to on_discard(message, reason).
+    """
+
+    def __init__(self, max_messages=100, max_bytes=65536, max_age=30, on_discard=None):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.on_discard = on_discard
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.dropped = 0
+        self.expired = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _key(subject, reply_subject, message):
+        return (subject, reply_subject, json.dumps(message.get("body"), sort_keys=True, default=str))
+
+    def push(self, subject, payload, reply_subject, message, headers=None):
+        """Queue a message for later delivery. Returns False if it was coalesced or dropped."""
+        self.expire()
+
+        if len(payload) > self.max_bytes:
+            self.dropped += 1
+            self._discard(message, "larger than outbound buffer")
+            return False
+
+        key = self._key(subject, reply_subject, message)
+        if key in self.entries:
+            self.coalesced += 1
+            self._discard(message, "duplicate of a queued message")
+            return False
+
+        self.entries[key] = OutboundEntry(subject, payload, reply_subject, message, headers)
+        self.size_bytes += len(payload)
+
+        while len(self.entries) > self.max_messages or self.size_bytes > self.max_bytes:
+            _, oldest = self.entries.popitem(last=False)
+            self.size_bytes -= len(oldest.payload)
+            self.dropped += 1
+            self._discard(oldest.message, "outbound buffer full")
+        return True
+
+    def expire(self):
+        """Drop entries that have been waiting longer than max_age seconds."""
+        deadline = time.monotonic() - self.max_age
+        while self.entries:
+            key, oldest = next(iter(self.entries.items()))
+            if oldest.queued_at > deadline:
+                break
+            del self.entries[key]
+            self.size_bytes -= len(oldest.payload)
+            self.expired += 1
+            self._discard(oldest.message, f"not delivered within {self.max_age:g}s")
+
+    def drain(self):
+        """Remove and return all entries still fresh enough to be replayed, oldest first."""
+        self.expire()
+        entries = list(self.entries.values())
+        self.entries.clear()
+        self.size_bytes = 0
+        return entries
+
+    def requeue(self, entries):
+        """Put back entries that could not be replayed, ahead of anything queued meanwhile."""
+        queued = list(self.entries.items())
+        self.entries.clear()
+        self.size_bytes = 0
+        for entry in entries:
+            self.entries[self._key(entry.subject, entry.reply_subject, entry.message)] = entry
+            self.size_bytes += len(entry.payload)
+        for key, entry in queued:
+            self.entries[key] = entry
+            self.size_bytes += len(entry.payload)
+
+    def _discard(self, message, reason):
+        logger.warning(f"Discarding outbound message '{message.get('body')}': {reason}")
+        if self.on_discard:
+            self.on_discard(message, reason)
+
+    def collect_metrics(self):
+        stats = self.get_stats()
+        return [
+            ("outbound_queued", "gauge", "Messages waiting in the outbound buffer", [({}, stats["queued"])]),
+            ("outbound_queued_bytes", "gauge", "Bytes waiting in the outbound buffer", [({}, stats["queued_bytes"])]),
+            ("outbound_discarded_total", "counter", "Outbound messages discarded while disconnected", [({"reason": reason}, stats[reason]) for reason in ("dropped", "expired", "coalesced")]),
+            ("outbound_replayed_total", "counter", "Outbound messages replayed after reconnecting", [({}, stats["replayed"])]),
+        ]
+
+    def get_stats(self):
+        return {
+            "queued": len(self.entries),
+            "queued_bytes": self.size_bytes,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+        }
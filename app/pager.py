@@ -0,0 +1,96 @@
+import shutil
+from collections import deque
+
+
+class Pager:
+    """Pages long reply output at the prompt instead of scrolling it past the operator.
+
+    Output written after a command is shown until it fills a screen; the rest is held and
+    the prompt is replaced by a --More-- status line. Space shows the next page, Enter one
+    more line and q skips what is held. Output arriving meanwhile (further chunks of a
+    streamed reply, other replies) is queued behind it, so order is kept. Without an
+    interactive line reader everything is written straight through.
+    """
+
+    def __init__(self, renderer, line_reader=None, page_lines=None):
+        self.renderer = renderer
+        self.line_reader = line_reader
+        self.page_lines = page_lines
+        self.shown = 0
+        self.held = deque()
+
+    @property
+    def active(self):
+        return self.line_reader is not None and self.line_reader.interactive
+
+    @property
+    def paused(self):
+        return bool(self.held)
+
+    def _page_size(self):
+        return self.page_lines or max(5, shutil.get_terminal_size().lines - 2)
+
+    def reset(self):
+        """Start a new page, called when the operator enters a command."""
+        self.shown = 0
+
+    def write(self, text):
+        if not self.active:
+            self.renderer.write(text)
+            return
+        lines = text.splitlines(keepends=True)
+        if self.held:
+            self.held.extend(lines)
+            self._show_status()
+            return
+        room = self._page_size() - self.shown
+        if len(lines) <= room:
+            self.shown += len(lines)
+            self.renderer.write(text)
+            return
+        if room > 0:
+            self.renderer.write("".join(lines[:room]))
+        self.shown += max(room, 0)
+        self.held.extend(lines[max(room, 0) :])
+        self.line_reader.key_handler = self.on_key
+        self._show_status()
+
+    def _show_status(self):
+        self.line_reader.status = f"{self.renderer.title}-- More ({len(self.held)} lines) -- space: next page, enter: next line, q: skip --{self.renderer.reset}"
+        self.line_reader.redraw()
+
+    def _release(self, count):
+        lines = [self.held.popleft() for _ in range(min(count, len(self.held)))]
+        self.renderer.write("".join(lines))
+
+    def on_key(self, char):
+        if char == " ":
+            self._release(self._page_size())
+        elif char in ("\r", "\n"):
+            self._release(1)
+        elif char in ("q", "Q", "\x1b"):
+            skipped = len(self.held)
+            self.held.clear()
+            self.renderer.write(f"({skipped} lines skipped)\n")
+        else:
+            return
+        if self.held:
+            self._show_status()
+        else:
+            self.resume()
+
+    def resume(self):
+        """Give the keyboard back to the line editor and restore the prompt."""
+        self.shown = 0
+        if self.line_reader is not None:
+            self.line_reader.key_handler = None
+            self.line_reader.status = None
+            self.line_reader.redraw()
+
+    def close(self):
+        """Write out anything held and detach from the line reader."""
+        if self.held:
+            self.renderer.write("".join(self.held))
+            self.held.clear()
+        self.resume()
+        self.line_reader = None
@@ -0,0 +1,154 @@
+import zlib
+import json_backend
+
+# msgpack is optional: without it every message is sent as JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# NATS headers: the codec of this payload, and the codecs the sender can decode
+CODEC_HEADER = "Dunebugger-Codec"
+ACCEPT_HEADER = "Dunebugger-Accept-Codec"
+
+DEFAULT_CODEC = "json"
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be decoded with the codec named in its header."""
+
+
+def _msgpack_dumps(obj):
+    return msgpack.packb(obj, default=str)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+# codec name -> (dumps, loads); both work on bytes
+FORMATS = {"json": (json_backend.dumps, json_backend.loads)}
+if msgpack is not None:
+    FORMATS["msgpack"] = (_msgpack_dumps, _msgpack_loads)
+
+COMPRESSION = "zlib"
+
+
+def parse_codecs(value):
+    """Parse an accept header value like 'msgpack, json, zlib' into a set of codec names."""
+    return frozenset(item.strip().lower() for item in value.split(",") if item.strip())
+
+
+def decode(data, headers=None):
+    """Decode a payload according to its codec header; payloads without one are JSON."""
+    codec = headers.get(CODEC_HEADER) if headers else None
+    if not codec or codec == DEFAULT_CODEC:
+        return json_backend.loads(data)
+
+    name, _, compression = codec.lower().partition("+")
+    if compression:
+        if compression != COMPRESSION:
+            raise CodecError(f"unsupported compression '{compression}'")
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as e:
+            raise CodecError(f"invalid {COMPRESSION} data: {e}") from e
+
+    if name == DEFAULT_CODEC:
+        return json_backend.loads(data)
+    functions = FORMATS.get(name)
+    if functions is None:
+        raise CodecError(f"unsupported codec '{name}'")
+    try:
+        return functions[1](data)
+    except Exception as e:
+        raise CodecError(f"invalid {name} payload: {e}") from e
+
+
+class PayloadCodec:
+    """Chooses the encoding of outbound messages per recipient.
+
+    A core advertises what it can decode in the Dunebugger-Accept-Codec header of its
+    messages. Until it has, or if it never does, messages to it are plain JSON without a
+    codec header, so JSON-only cores keep working. Messages under codec_threshold bytes of
+    JSON stay JSON even then: a binary encoding saves less on them than its codec header
+    costs. Payloads of compress_threshold bytes or
+    more are zlib-compressed for recipients that accept it (0 disables compression).
+    """
+
+    def __init__(self, preferred="msgpack", codec_threshold=512, compress_threshold=1024, compress_level=6):
+        self.set_preferred(preferred)
+        self.codec_threshold = codec_threshold
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.accepted = {}
+        self.accept_value = ", ".join([*FORMATS, COMPRESSION])
+        self.advertised = set()  # recipients a message with the accept header was published to
+        self.encoded = {}
+        self.bytes_uncompressed = 0
+        self.bytes_wire = 0
+
+    def set_preferred(self, preferred):
+        self.preferred = preferred if preferred in FORMATS else DEFAULT_CODEC
+
+    def learn(self, source, headers):
+        """Record the codecs a core accepts, from the headers of a message it sent."""
+        if headers and source is not None:
+            accept = headers.get(ACCEPT_HEADER)
+            if accept:
+                # A core announcing itself, even with the same codecs, may have restarted and
+                # forgotten what we accept
+                self.advertised.discard(source)
+                self.accepted[source] = parse_codecs(accept)
+
+    def published(self, recipient, headers):
+        """Note that a message encoded for recipient was published with these headers."""
+        if headers and ACCEPT_HEADER in headers:
+            self.advertised.add(recipient)
+
+    def reset_advertised(self):
+        """Advertise again to every recipient, e.g. after a reconnect, when cores may have restarted."""
+        self.advertised.clear()
+
+    def codec_for(self, recipient, size):
+        """The codec for a message to recipient that is size bytes as JSON."""
+        accepted = self.accepted.get(recipient)
+        if not accepted:
+            return DEFAULT_CODEC
+        name = self.preferred if self.preferred in accepted and size >= self.codec_threshold else DEFAULT_CODEC
+        if self.compress_threshold and size >= self.compress_threshold and COMPRESSION in accepted:
+            return f"{name}+{COMPRESSION}"
+        return name
+
+    def encode(self, message, recipient):
+        """Return (payload, headers) for a message to recipient; headers is None when there are none.
+
+        The accept header goes out until a message carrying it is published (see published())
+        rather than on every message, it would add about 40 bytes to commands of 100-200 bytes."""
+        # Sizes are measured as JSON, most messages are small and go out as the JSON itself
+        data = json_backend.dumps(message)
+        size = len(data)
+        codec = self.codec_for(recipient, size)
+        name, _, compression = codec.partition("+")
+        if name != DEFAULT_CODEC:
+            data = FORMATS[name][0](message)
+            size = len(data)
+        if compression:
+            data = zlib.compress(data, self.compress_level)
+
+        self.encoded[codec] = self.encoded.get(codec, 0) + 1
+        self.bytes_uncompressed += size
+        self.bytes_wire += len(data)
+        headers = None
+        if recipient not in self.advertised:
+            headers = {ACCEPT_HEADER: self.accept_value}
+        if codec != DEFAULT_CODEC:
+            headers = headers or {}
+            headers[CODEC_HEADER] = codec
+        return data, headers
+
+    def collect_metrics(self):
+        return [
+            ("messages_encoded_total", "counter", "Outbound messages by payload codec", [({"codec": codec}, count) for codec, count in self.encoded.items()]),
+            ("payload_bytes_total", "counter", "Outbound payload bytes before and after compression", [({"stage": "uncompressed"}, self.bytes_uncompressed), ({"stage": "wire"}, self.bytes_wire)]),
+        ]
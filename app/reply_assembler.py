@@ -0,0 +1,80 @@
+import asyncio
+from dunebugger_logging import logger
+
+
+class ChunkStream:
+    __slots__ = ("key", "subject", "total", "chunks", "next_seq", "quiet", "incremental", "assembled", "timer", "duplicates", "pending")
+
+    def __init__(self, key, subject, total, quiet, incremental):
+        self.key = key
+        self.subject = subject
+        self.total = total
+        self.chunks = {}  # seq -> body, for chunks that arrived ahead of a missing one
+        self.next_seq = 0
+        self.quiet = quiet
+        self.incremental = incremental
+        self.assembled = None
+        self.timer = None
+        self.duplicates = 0
+        self.pending = None  # PendingRequest that gets the assembled reply
+
+    def missing(self):
+        return [seq for seq in range(self.next_seq, self.total) if seq not in self.chunks]
+
+
+class ReplyAssembler:
+    """Puts chunked replies (envelopes with seq and total) back in order.
+
+    Each chunk is handed back as soon as every chunk before it has arrived, so replies can
+    be rendered while they stream in. A stream that receives no chunk for timeout seconds
+    is abandoned and passed to on_timeout(stream).
+    """
+
+    def __init__(self, timeout=10, on_timeout=None):
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.streams = {}
+        self.completed = 0
+        self.timed_out = 0
+
+    def open(self, key, subject, total, quiet=False, incremental=True):
+        stream = ChunkStream(key, subject, total, quiet, incremental)
+        self.streams[key] = stream
+        return stream
+
+    def add(self, stream, seq, body):
+        """Store a chunk and return the (seq, body) pairs now ready, in order."""
+        if not 0 <= seq < stream.total or seq < stream.next_seq or seq in stream.chunks:
+            stream.duplicates += 1
+            return []
+        stream.chunks[seq] = body
+
+        ready = []
+        while stream.next_seq in stream.chunks:
+            ready.append((stream.next_seq, stream.chunks.pop(stream.next_seq)))
+            stream.next_seq += 1
+
+        if stream.timer is not None:
+            stream.timer.cancel()
+            stream.timer = None
+        if stream.next_seq == stream.total:
+            del self.streams[stream.key]
+            self.completed += 1
+        else:
+            stream.timer = asyncio.get_running_loop().call_later(self.timeout, self._expire, stream.key)
+        return ready
+
+    def _expire(self, key):
+        stream = self.streams.pop(key, None)
+        if stream is None:
+            return
+        self.timed_out += 1
+        logger.warning(f"Chunked {stream.subject} reply incomplete after {self.timeout:g}s without new chunks: missing {len(stream.missing())} of {stream.total} chunks")
+        if self.on_timeout is not None:
+            self.on_timeout(stream)
+
+    def collect_metrics(self):
+        return [
+            ("chunked_replies_total", "counter", "Chunked replies by outcome", [({"outcome": "completed"}, self.completed), ({"outcome": "timed_out"}, self.timed_out)]),
+            ("chunked_replies_in_progress", "gauge", "Chunked replies being reassembled", [({}, len(self.streams))]),
+        ]
@@ -0,0 +1,198 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from dunebugger_logging import logger
+
+# Subjects the core uses to answer a terminal_command
+REPLY_SUBJECTS = frozenset(["terminal_command_reply", "show_gpio_status", "show_configuration", "commands_list"])
+COMMAND_REPLY_SUBJECTS = REPLY_SUBJECTS - {"commands_list"}
+
+
+class LatencyStats:
+    """Rolling window of round-trip samples with percentile summaries."""
+
+    def __init__(self, window=1024):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.timeouts = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class PendingRequest:
+    __slots__ = ("correlation_id", "command", "recipient", "reply_subjects", "future", "created_at", "sent_at", "timeout", "timer", "quiet")
+
+    def __init__(self, correlation_id, command, recipient, reply_subjects, future, timeout, quiet=False):
+        self.correlation_id = correlation_id
+        self.command = command
+        self.recipient = recipient
+        self.reply_subjects = reply_subjects
+        self.future = future
+        self.created_at = time.monotonic()
+        self.sent_at = None
+        self.timeout = timeout
+        self.timer = None
+        self.quiet = quiet  # the reply is consumed by whoever awaits the future, not rendered
+
+    @property
+    def name(self):
+        """Command name used to group latency samples (first word of the command)."""
+        return self.command.split(" ", 1)[0] if isinstance(self.command, str) and self.command else str(self.command)
+
+
+class RequestTracker:
+    """Correlates dispatched commands with the replies coming back from the core.
+
+    Every command gets a correlation ID and a future in the in-flight table. The future
+    resolves with the reply (subject, body, latency) or with None when no reply arrives
+    within the timeout. Replies carrying a correlation_id are matched exactly; replies from
+    cores that do not echo it are matched to the oldest in-flight command expecting that subject.
+    """
+
+    def __init__(self, timeout=10.0, window=1024):
+        self.timeout = timeout
+        self.window = window
+        self.in_flight = {}
+        self.stats = {}
+        self.total = LatencyStats(window)
+        self.unmatched_replies = 0
+
+    def new_correlation_id(self):
+        return uuid.uuid4().hex
+
+    def track(self, command, recipient, reply_subjects=COMMAND_REPLY_SUBJECTS, timeout=None, quiet=False):
+        """Register a command before it is sent and return its PendingRequest."""
+        future = asyncio.get_running_loop().create_future()
+        pending = PendingRequest(self.new_correlation_id(), command, recipient, frozenset(reply_subjects), future, timeout or self.timeout, quiet)
+        self.in_flight[pending.correlation_id] = pending
+        return pending
+
+    def mark_sent(self, correlation_id):
+        """Start the round-trip clock and the timeout once the command is on the wire."""
+        pending = self.in_flight.get(correlation_id)
+        if pending is None or pending.sent_at is not None:
+            return
+        pending.sent_at = time.monotonic()
+        pending.timer = asyncio.get_running_loop().call_later(pending.timeout, self._expire, correlation_id)
+
+    def discard(self, correlation_id):
+        """Forget a command that never made it to the wire."""
+        pending = self.in_flight.pop(correlation_id, None)
+        if pending is None:
+            return
+        if pending.timer:
+            pending.timer.cancel()
+        if not pending.future.done():
+            pending.future.set_result(None)
+
+    def resolve(self, subject, body, correlation_id=None, source=None, complete=True):
+        """Match an inbound reply to its in-flight command. Returns the PendingRequest or None.
+
+        Without a correlation_id, the reply goes to the oldest command sent to its source,
+        or to the oldest command expecting this subject if none was sent to that source.
+        With complete=False, for the first chunk of a chunked reply, the latency is recorded
+        but the future is left for finish() once the whole reply is in."""
+        if subject not in REPLY_SUBJECTS:
+            return None
+
+        if correlation_id is not None:
+            pending = self.in_flight.pop(correlation_id, None)
+        else:
+            pending = None
+            for candidate in self.in_flight.values():
+                if candidate.sent_at is not None and subject in candidate.reply_subjects:
+                    if pending is None:
+                        pending = candidate
+                    if source is None or candidate.recipient == source:
+                        pending = candidate
+                        break
+            if pending is not None:
+                del self.in_flight[pending.correlation_id]
+
+        if pending is None:
+            self.unmatched_replies += 1
+            return None
+
+        if pending.timer:
+            pending.timer.cancel()
+        latency = time.monotonic() - (pending.sent_at or pending.created_at)
+        self._stats_for(pending.name).add(latency)
+        self.total.add(latency)
+        if complete:
+            self.finish(pending, subject, body, source)
+        return pending
+
+    def finish(self, pending, subject, body, source=None):
+        """Resolve the future of a matched command with its reply, or None if body is None."""
+        if pending.future.done():
+            return
+        if body is None:
+            pending.future.set_result(None)
+            return
+        latency = time.monotonic() - (pending.sent_at or pending.created_at)
+        pending.future.set_result({"subject": subject, "body": body, "latency": latency, "source": source})
+
+    def _expire(self, correlation_id):
+        pending = self.in_flight.pop(correlation_id, None)
+        if pending is None:
+            return
+        self._stats_for(pending.name).timeouts += 1
+        self.total.timeouts += 1
+        logger.warning(f"No reply to '{pending.command}' from {pending.recipient} after {pending.timeout:g}s, command may be stuck")
+        if not pending.future.done():
+            pending.future.set_result(None)
+
+    def _stats_for(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = LatencyStats(self.window)
+        return stats
+
+    def collect_metrics(self):
+        samples = []
+        for name, stats in sorted(self.stats.items()):
+            summary = stats.summary()
+            samples.extend(({"command": name, "quantile": quantile}, summary[key]) for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")))
+        return [
+            ("commands_in_flight", "gauge", "Commands waiting for a reply", [({}, len(self.in_flight))]),
+            ("command_timeouts_total", "counter", "Commands that got no reply in time", [({"command": name}, stats.timeouts) for name, stats in sorted(self.stats.items())]),
+            ("command_round_trip_seconds", "gauge", "Command round-trip latency percentiles", samples),
+        ]
+
+    def latency_report(self):
+        """Return a printable per-command round-trip latency table."""
+        lines = [f"{'command':<24}{'count':>8}{'timeouts':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        rows = sorted(self.stats.items()) + [("(all)", self.total)]
+        for name, stats in rows:
+            s = stats.summary()
+            lines.append(f"{name:<24}{s['count']:>8}{s['timeouts']:>10}{s['p50'] * 1000:>10.1f}{s['p95'] * 1000:>10.1f}{s['p99'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}")
+
+        now = time.monotonic()
+        lines.append(f"In flight: {len(self.in_flight)}, unmatched replies: {self.unmatched_replies}")
+        for pending in self.in_flight.values():
+            state = f"sent {now - pending.sent_at:.1f}s ago" if pending.sent_at is not None else "not sent yet"
+            lines.append(f"    {pending.command} -> {pending.recipient}: {state}")
+        return "\n".join(lines)
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import struct
+import time
+from dunebugger_logging import logger
+from loopback_nats import LoopbackMsg
+
+# File layout: MAGIC, then one frame per inbound message:
+# FRAME header (timestamp, subject length, headers length, data length), subject, headers as JSON, data
+MAGIC = b"DBREC1\n"
+FRAME = struct.Struct("<dHII")
+
+
+class SessionRecorder:
+    """Appends every inbound message, with its arrival time, to an append-only recording file.
+
+    Frames go through a buffered file, so recording costs a memory copy per message. A
+    loop timer flushes the buffer flush_interval seconds after the first unflushed frame,
+    so the tail of the recording reaches the disk even if traffic then stops and the
+    process is killed.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.flush_interval = flush_interval
+        self.flush_timer = None
+        self.recorded = 0
+
+    def record(self, mqueue_message):
+        subject = mqueue_message.subject.encode()
+        headers = getattr(mqueue_message, "headers", None)
+        headers = json.dumps(headers).encode() if headers else b""
+        data = mqueue_message.data or b""
+        self.file.write(FRAME.pack(time.time(), len(subject), len(headers), len(data)))
+        self.file.write(subject)
+        self.file.write(headers)
+        self.file.write(data)
+        self.recorded += 1
+        if self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self.flush_timer = None
+        if not self.file.closed:
+            self.file.flush()
+
+    def close(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.file.closed:
+            self.file.close()
+            logger.info(f"Recorded {self.recorded} inbound messages to {self.path}")
+
+
+def read_recording(path):
+    """Yield (timestamp, message) for each frame of a recording; stops at a truncated frame."""
+    with open(path, "rb") as recording:
+        if recording.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a dunebugger session recording")
+        while True:
+            header = recording.read(FRAME.size)
+            if not header:
+                return
+            if len(header) < FRAME.size:
+                logger.warning(f"Recording {path} ends with a truncated frame")
+                return
+            timestamp, subject_length, headers_length, data_length = FRAME.unpack(header)
+            body = recording.read(subject_length + headers_length + data_length)
+            if len(body) < subject_length + headers_length + data_length:
+                logger.warning(f"Recording {path} ends with a truncated frame")
+                return
+            subject = body[:subject_length].decode()
+            headers = json.loads(body[subject_length : subject_length + headers_length]) if headers_length else None
+            yield timestamp, LoopbackMsg(subject, body[subject_length + headers_length :], headers=headers)
+
+
+class SessionReplayer:
+    """Feeds a recording to process(message) at its original pace divided by speed.
+
+    A speed of 0 replays as fast as the pipeline can process the messages.
+    """
+
+    def __init__(self, process, speed=1.0):
+        self.process = process
+        self.speed = speed
+        self.replayed = 0
+        self.max_lag = 0.0
+
+    async def run(self, path):
+        """Replay the recording at path; returns the elapsed time in seconds."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first_timestamp = None
+        for timestamp, message in read_recording(path):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            if self.speed > 0:
+                due = start + (timestamp - first_timestamp) / self.speed
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif -delay > self.max_lag:
+                    self.max_lag = -delay
+            await self.process(message)
+            self.replayed += 1
+        return loop.time() - start
+
+    def summary(self, elapsed):
+        rate = self.replayed / elapsed if elapsed > 0 else 0.0
+        pace = f"{self.speed:g}x speed, max lag behind schedule {self.max_lag * 1000:.1f} ms" if self.speed > 0 else "max speed"
+        return f"Replayed {self.replayed} messages in {elapsed:.2f}s ({rate:,.0f} msgs/sec, {pace})"
@@ -0,0 +1,29 @@
+import time
+
+
+class StartupTimer:
+    """Records how long after process start each startup milestone was reached."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.marks = []
+
+    def mark(self, stage):
+        """Record a milestone; only the first occurrence of each stage is kept."""
+        if not any(name == stage for name, _ in self.marks):
+            self.marks.append((stage, time.perf_counter()))
+
+    def has_mark(self, stage):
+        return any(name == stage for name, _ in self.marks)
+
+    def breakdown(self):
+        """Return a printable table of milestones with the time spent in each step."""
+        lines = ["Startup timing breakdown:"]
+        previous = self.started_at
+        for stage, timestamp in self.marks:
+            lines.append(f"    {stage:<32}+{(timestamp - previous) * 1000:8.1f} ms  (at {(timestamp - self.started_at) * 1000:8.1f} ms)")
+            previous = timestamp
+        return "\n".join(lines)
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,397 @@
+import asyncio
+import os
+import stat
+import tempfile
+import time
+from collections import OrderedDict
+import json_backend
+import payload_codec
+from dunebugger_logging import logger
+from loopback_nats import LoopbackMsg
+from request_tracker import REPLY_SUBJECTS
+from utils import parse_subject, backoff_delay, wait_for_event
+
+# Frames are newline-delimited JSON objects with an "op" field:
+#   client -> daemon: send (recipient, reply_subject, message)
+#   daemon -> client: status (ready), message (subject, message), published / discarded (correlation_id)
+
+
+def encode_frame(frame):
+    return json_backend.dumps(frame) + b"\n"
+
+
+def resolve_socket_path(configured):
+    """Return the daemon socket path, or None if the default location can't be made private.
+
+    Without a configured path the socket goes in $XDG_RUNTIME_DIR, or else in a directory
+    under the temp dir that only this user can enter: a fixed path in /tmp could be created
+    first by another user, and terminals would attach to their socket.
+    """
+    if configured:
+        return os.path.expanduser(configured)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"dunebugger-terminal-{os.getuid()}")
+        try:
+            os.makedirs(runtime_dir, mode=0o700, exist_ok=True)
+            info = os.lstat(runtime_dir)
+        except OSError as e:
+            logger.error(f"Cannot create the terminal daemon directory {runtime_dir}: {e}")
+            return None
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            logger.error(f"Not using {runtime_dir} for the terminal daemon socket: it is not a private directory of this user")
+            return None
+    return os.path.join(runtime_dir, "dunebugger-terminal.sock")
+
+
+def is_own_socket(path):
+    """True if path is a Unix socket owned by this user."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+
+class DaemonClientConnection:
+    __slots__ = ("writer", "name", "dropped")
+
+    def __init__(self, writer, name):
+        self.writer = writer
+        self.name = name
+        self.dropped = 0
+
+
+class DaemonRoute:
+    __slots__ = ("client", "sent_at", "chunks")
+
+    def __init__(self, client, sent_at):
+        self.client = client
+        self.sent_at = sent_at
+        self.chunks = None  # seqs forwarded so far of a chunked reply
+
+
+class TerminalDaemon:
+    """Holds the NATS connection and serves terminal clients over a Unix domain socket.
+
+    It takes the place of MessagingQueueHandler for NATSComm: commands from clients are
+    published through the shared connection, replies are routed by correlation ID to the
+    client that sent the command (or, from cores that don't echo it, to the client with the
+    oldest command still waiting), and everything else is fanned out to all clients.
+    A route is kept until every chunk of a chunked reply went to its client, or route_ttl.
+    A client that stops reading loses messages instead of stalling the others.
+    """
+
+    def __init__(self, mqueue, socket_path, route_ttl=300, max_client_buffer=1048576):
+        self.mqueue = mqueue
+        self.socket_path = socket_path
+        self.route_ttl = route_ttl
+        self.max_client_buffer = max_client_buffer
+        self.codec = mqueue.mqueue_handler.codec
+        self.clients = set()
+        self.routes = OrderedDict()  # correlation_id -> DaemonRoute
+        self.streams = OrderedDict()  # (subject, stream_id or source) -> DaemonRoute of chunked replies without correlation ID
+        self.server = None
+        self.client_count = 0
+        mqueue.mqueue_handler = self
+        mqueue.outbound_buffer.on_discard = self.message_discarded
+        mqueue.on_ready_change = self.ready_changed
+
+    async def start(self):
+        """Listen on socket_path. Returns False if it is taken, e.g. by a daemon already running."""
+        if os.path.lexists(self.socket_path):
+            if not is_own_socket(self.socket_path):
+                logger.error(f"{self.socket_path} exists and is not a socket of this user, not starting the terminal daemon")
+                return False
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)  # left behind by a daemon that did not exit cleanly
+            else:
+                writer.close()
+                logger.error(f"Another terminal daemon is already listening on {self.socket_path}")
+                return False
+        self.server = await asyncio.start_unix_server(self._serve_client, self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"Terminal daemon listening on {self.socket_path}")
+        return True
+
+    async def stop(self):
+        # Only remove the socket this daemon created, never the one of a daemon that was already running
+        if self.server is None:
+            return
+        self.server.close()
+        for client in list(self.clients):
+            client.writer.close()
+        await self.server.wait_closed()
+        self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _serve_client(self, reader, writer):
+        self.client_count += 1
+        client = DaemonClientConnection(writer, f"client-{self.client_count}")
+        self.clients.add(client)
+        logger.info(f"Terminal {client.name} attached ({len(self.clients)} attached)")
+        self._write(client, {"op": "status", "ready": self.mqueue.ready.is_set()})
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    frame = json_backend.loads(line)
+                except json_backend.JSONDecodeError as e:
+                    logger.error(f"Invalid frame from {client.name}: {e}")
+                    continue
+                if frame.get("op") == "send":
+                    await self._send(client, frame)
+                else:
+                    logger.warning(f"Unknown frame from {client.name}: {frame.get('op')}")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(client)
+            for routes in (self.routes, self.streams):
+                for key in [key for key, route in routes.items() if route.client is client]:
+                    del routes[key]
+            writer.close()
+            logger.info(f"Terminal {client.name} detached ({len(self.clients)} attached, {client.dropped} messages dropped)")
+
+    async def _send(self, client, frame):
+        message = frame["message"]
+        correlation_id = message.get("correlation_id")
+        if correlation_id is not None:
+            self._expire_routes()
+            self.routes[correlation_id] = DaemonRoute(client, time.monotonic())
+        if await self.mqueue.send(message, frame["recipient"], frame.get("reply_subject")):
+            self.message_published(message)
+
+    def _expire_routes(self):
+        deadline = time.monotonic() - self.route_ttl
+        for routes in (self.routes, self.streams):
+            while routes:
+                key, route = next(iter(routes.items()))
+                if route.sent_at > deadline:
+                    break
+                del routes[key]
+
+    def _write(self, client, frame):
+        if client.writer.transport.get_write_buffer_size() > self.max_client_buffer:
+            client.dropped += 1
+            if client.dropped % 1000 == 1:
+                logger.warning(f"Terminal {client.name} is not reading, dropping messages ({client.dropped} dropped so far)")
+            return
+        client.writer.write(encode_frame(frame))
+
+    def _owner(self, message, pop=False):
+        correlation_id = message.get("correlation_id")
+        route = self.routes.pop(correlation_id, None) if pop else self.routes.get(correlation_id)
+        return route.client if route else None
+
+    def message_published(self, message):
+        client = self._owner(message)
+        if client is not None:
+            self._write(client, {"op": "published", "correlation_id": message["correlation_id"]})
+
+    def message_discarded(self, message, reason):
+        client = self._owner(message, pop=True)
+        if client is not None:
+            self._write(client, {"op": "discarded", "correlation_id": message["correlation_id"], "reason": reason})
+
+    def ready_changed(self, ready):
+        for client in list(self.clients):
+            self._write(client, {"op": "status", "ready": ready})
+
+    async def process_mqueue_message(self, mqueue_message):
+        """Route one inbound message to the client waiting for it, or to every client."""
+        headers = getattr(mqueue_message, "headers", None)
+        try:
+            message = payload_codec.decode(mqueue_message.data, headers)
+            subject = parse_subject(mqueue_message.subject)
+        except (ValueError, TypeError, AttributeError, IndexError) as e:
+            logger.error(f"Failed to decode message for terminals: {e}")
+            return
+        if message.get("source") is not None:
+            self.codec.learn(message["source"], headers)
+
+        route = None
+        correlation_id = message.get("correlation_id")
+        if correlation_id is not None:
+            route = self.routes.get(correlation_id)
+            if route is not None and self._reply_complete(route, message):
+                del self.routes[correlation_id]
+        elif subject in REPLY_SUBJECTS:
+            # The oldest waiting command takes the reply, and the rest of a chunked reply follows it
+            self._expire_routes()
+            stream_key = (subject, message.get("stream_id") or message.get("source"))
+            route = self.streams.get(stream_key)
+            if route is None and self.routes:
+                _, route = self.routes.popitem(last=False)
+                self.streams[stream_key] = route
+            if route is not None and self._reply_complete(route, message):
+                del self.streams[stream_key]
+
+        frame = {"op": "message", "subject": mqueue_message.subject, "message": message}
+        if route is not None:
+            if route.client in self.clients:
+                self._write(route.client, frame)
+            return
+        for client in list(self.clients):
+            self._write(client, frame)
+
+    def _reply_complete(self, route, message):
+        """Count one reply message on route; True once the last chunk of the reply went through."""
+        total = message.get("total", 1)
+        if total <= 1:
+            return True
+        # Chunks can arrive out of order, so count them rather than waiting for seq == total - 1
+        if route.chunks is None:
+            route.chunks = set()
+        route.chunks.add(message.get("seq"))
+        return len(route.chunks) >= total
+
+
+class DaemonClient:
+    """Stand-in for NATSComm in terminals attached to a TerminalDaemon.
+
+    Messages from the daemon go through the same inbound dispatcher and handler as with a
+    direct connection. A command counts as published when the daemon reports it was, and
+    while the daemon is unreachable commands wait in the outbound buffer. Commands the daemon
+    had not reported on when the connection dropped are discarded: they may have been published.
+    """
+
+    def __init__(self, socket_path, mqueue_handler, outbound_buffer, inbound_dispatcher):
+        self.socket_path = socket_path
+        self.servers = f"unix://{socket_path}"
+        self.mqueue_handler = mqueue_handler
+        self.outbound_buffer = outbound_buffer
+        self.outbound_buffer.on_discard = mqueue_handler.message_discarded
+        self.inbound_dispatcher = inbound_dispatcher
+        self.inbound_dispatcher.process = self.mqueue_handler.process_mqueue_message
+        self.ready = asyncio.Event()  # set while the daemon is connected to NATS
+        self.is_connected = False  # connected to the daemon
+        self.reader = None
+        self.writer = None
+        self.connection_task = None
+        self.in_flight = OrderedDict()  # correlation_id -> message handed to the daemon, not reported on yet
+        self.retry_initial = 0.5
+        self.retry_interval = 10
+
+    async def connect(self):
+        if not is_own_socket(self.socket_path):
+            logger.debug(f"No terminal daemon socket of this user at {self.socket_path}")
+            return False
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path)
+            self.is_connected = True
+            return True
+        except OSError as e:
+            logger.debug(f"Failed to connect to terminal daemon: {e}")
+            return False
+
+    async def _connection_loop(self):
+        attempt = 0
+        while True:
+            try:
+                if self.is_connected or await self.connect():
+                    logger.info(f"Attached to terminal daemon on {self.socket_path}")
+                    attempt = 0
+                    self.replay_outbound()
+                    await self._read_frames()
+                    logger.warning("Terminal daemon connection lost")
+                self.is_connected = False
+                self.ready.clear()
+                delay = backoff_delay(attempt, self.retry_initial, self.retry_interval)
+                attempt += 1
+                self.outbound_buffer.expire()
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Unexpected error in daemon connection loop: {e}")
+                self.is_connected = False
+                await asyncio.sleep(self.retry_interval)
+
+    async def _read_frames(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    return
+                frame = json_backend.loads(line)
+                op = frame.get("op")
+                if op == "message":
+                    self.inbound_dispatcher.put(LoopbackMsg(frame["subject"], json_backend.dumps(frame["message"])))
+                elif op == "published":
+                    self.in_flight.pop(frame.get("correlation_id"), None)
+                    self.mqueue_handler.message_published(frame)
+                elif op == "discarded":
+                    self.in_flight.pop(frame.get("correlation_id"), None)
+                    self.mqueue_handler.message_discarded(frame, frame.get("reason"))
+                elif op == "status":
+                    if frame["ready"]:
+                        self.ready.set()
+                    else:
+                        self.ready.clear()
+        finally:
+            self.is_connected = False
+            self.writer.close()
+            self.discard_in_flight()
+
+    def discard_in_flight(self):
+        """Give up on the commands the daemon did not report on, nothing will arrive for them any more."""
+        messages = list(self.in_flight.values())
+        self.in_flight.clear()
+        for message in messages:
+            self.mqueue_handler.message_discarded(message, "terminal daemon disconnected")
+        if messages:
+            logger.warning(f"Terminal daemon disconnected before reporting on {len(messages)} commands")
+
+    def _hand_over(self, payload, message):
+        self.writer.write(payload)
+        if "correlation_id" in message:
+            self.in_flight[message["correlation_id"]] = message
+
+    def replay_outbound(self):
+        entries = self.outbound_buffer.drain()
+        for entry in entries:
+            self._hand_over(entry.payload, entry.message)
+        self.outbound_buffer.replayed += len(entries)
+        if entries:
+            logger.info(f"Replayed {len(entries)} queued messages to the terminal daemon")
+
+    async def send(self, message, recipient, reply_subject=None):
+        """Hand a message to the daemon. Always returns False: the daemon reports when it is published."""
+        payload = encode_frame({"op": "send", "recipient": recipient, "reply_subject": reply_subject, "message": message})
+        if not self.is_connected:
+            if self.outbound_buffer.push(recipient, payload, reply_subject, message):
+                logger.warning(f"Terminal daemon not reachable, message queued for delivery ({len(self.outbound_buffer)} queued)")
+            return False
+        try:
+            self._hand_over(payload, message)
+            await self.writer.drain()
+        except ConnectionError as e:
+            logger.error(f"Error sending message to the terminal daemon, queueing it for delivery: {e}")
+            self.in_flight.pop(message.get("correlation_id"), None)
+            self.outbound_buffer.push(recipient, payload, reply_subject, message)
+        return False
+
+    async def start_listener(self):
+        self.inbound_dispatcher.start()
+        self.connection_task = asyncio.create_task(self._connection_loop())
+        return self.connection_task
+
+    async def close_listener(self):
+        if self.connection_task and not self.connection_task.done():
+            self.connection_task.cancel()
+            await asyncio.gather(self.connection_task, return_exceptions=True)
+        if self.writer is not None:
+            self.writer.close()
+        await self.inbound_dispatcher.stop()
+
+    async def wait_until_ready(self, timeout=None):
+        return await wait_for_event(self.ready, timeout)
+
+    def get_connection_status(self):
+        return self.is_connected and self.ready.is_set()
@@ -1,51 +1,170 @@
 import readline
 import os
+import re
 import asyncio
 import atexit
 import traceback
 import sys
 
 from dunebugger_settings import settings
-from dunebugger_logging import logger, COLORS
+from dunebugger_logging import logger, COLORS, get_logging_level_from_name, console_handler
+from log_relay import CoreLogRelay, parse_rate_limits
+from gpio_watch import GpioWatcher
+from fleet import FleetManager, parse_core_list
+from message_history import parse_time
+from pager import Pager
+from terminal_renderer import TerminalRenderer
+from line_reader import AsyncLineReader, PromptAwareStream
+from commands_cache import CommandsCache, content_hash
+from metrics import metrics
+from startup_timing import startup_timer
+
+
+def read_history_file(path):
+    """Return the lines of a readline history file, [] if there is none."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as history_file:
+            lines = history_file.read().splitlines()
+    except FileNotFoundError:
+        return []
+    if lines[:1] == ["_HiStOrY_V2_"]:
+        # libedit's format: a header line, and spaces and other characters as octal escapes
+        return [re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), line) for line in lines[1:]]
+    return lines
 
 
 class TerminalInterpreter:
+    # Commands handled by the terminal itself, offered for tab completion with the core ones
+    LOCAL_COMMANDS = ["h", "?", "stats", "latency", "queues", "watch", "corelog", "fleet", "history", "exit", "quit", "q"]
+
     def __init__(self, mqueue_handler):
 
-        history_path = "~/.python_history"
-        self.enableHistory(history_path)
-        atexit.register(self.save_history, history_path)
+        # The history file is read in the background once the prompt is up, see terminal_listen
+        self.history_path = "~/.python_history"
+        self.history_loaded = False
+        readline.set_history_length(settings.commandHistoryLength)
+        atexit.register(self.save_history, self.history_path)
+        self.profile_startup = False
         self.mqueue_handler = mqueue_handler
         self.help = "Help not loaded yet."
+        self.command_names = []
+        self.commands_hash = None
+        self.commands_cache = CommandsCache(settings.commandsCacheFile)
+        self.line_reader = None
         self.running = True
+        self.core_log_relay = CoreLogRelay(
+            self._log_queue_message,
+            min_level=settings.coreLogMinLevel,
+            rate_limits=parse_rate_limits(settings.coreLogRateLimit),
+            dedup_window=settings.coreLogDedupWindow,
+        )
+        self.renderer = TerminalRenderer()
+        self.pager = Pager(self.renderer)
+        self.gpio_watcher = GpioWatcher(self.request_gpio_status, self.renderer, self.output_mark)
+        self.gpio_chunks = []
+        self.fleet = FleetManager(mqueue_handler, self.renderer, cores=parse_core_list(settings.fleetCores), deadline=settings.fleetDeadline)
+        self.reply_handlers = {}
+        self.register_reply_handler("show_gpio_status", self.handle_show_gpio_status)
+        self.register_reply_handler("show_configuration", self.handle_show_configuration)
+        self.register_reply_handler("log_message", self.handle_log_message)
+        self.register_reply_handler("commands_list", self.handle_commands_list)
+        self.register_reply_handler("terminal_command_reply", self.handle_command_reply)
+        # Chunked replies of these subjects are rendered chunk by chunk as they arrive
+        self.chunk_handlers = {
+            "show_gpio_status": self.handle_gpio_status_chunk,
+            "show_configuration": self.handle_configuration_chunk,
+            "terminal_command_reply": self.handle_command_reply_chunk,
+        }
+        self.load_commands_cache()
+
+    def apply_settings(self):
+        """Take over the settings that can change while running, after the configuration is reloaded."""
+        readline.set_history_length(settings.commandHistoryLength)
+        self.core_log_relay.set_min_level(settings.coreLogMinLevel)
+        self.core_log_relay.set_rate_limits(parse_rate_limits(settings.coreLogRateLimit))
+        self.core_log_relay.dedup_window = settings.coreLogDedupWindow
+        self.fleet.configured_cores = set(parse_core_list(settings.fleetCores))
+        self.fleet.deadline = settings.fleetDeadline
+
+    def output_mark(self):
+        """Changes whenever anything is written to the terminal at the prompt, None without a prompt."""
+        if self.line_reader is None or not isinstance(self.renderer.stream, PromptAwareStream):
+            return None
+        return self.renderer.stream.writes, self.line_reader.scrolls
+
+    def register_reply_handler(self, subject, handler):
+        """Register the callable that renders replies received on subject."""
+        self.reply_handlers[subject] = handler
+
+    def has_reply_handler(self, subject):
+        return subject in self.reply_handlers
+
+    def has_chunk_handler(self, subject):
+        return subject in self.chunk_handlers
+
+    def handle_reply_chunk(self, subject, body, first, last):
+        """Render one chunk of a chunked reply; first and last tell where it is in the reply."""
+        self.chunk_handlers[subject](body, first, last)
 
     async def terminal_handle_reply(self, subject, command_reply_message):
         """Handle replies from the command interpreter."""
         if command_reply_message:
-            if subject == "show_gpio_status":
-                self.handle_show_gpio_status(command_reply_message)
-            elif subject == "show_configuration":
-                self.handle_show_configuration(command_reply_message)
-            elif subject == "log_message":
-                self._log_queue_message(command_reply_message["level"], command_reply_message["message"])
-            elif subject == "commands_list":
-                self.help = self.setup_help(commands_list = command_reply_message)
-            elif subject == "terminal_command_reply":
-                if command_reply_message["success"] == True:
-                    print(command_reply_message["message"])
-                else:
-                    if command_reply_message["level"].lower() == "error":
-                        print(f"{COLORS['RED']}{command_reply_message['message']}{COLORS['RESET']}")
-                    elif command_reply_message["level"].lower() == "warning":
-                        print(f"{COLORS['YELLOW']}{command_reply_message['message']}{COLORS['RESET']}")
-                    else:
-                        print(f"{COLORS['MAGENTA']}{command_reply_message['message']}{COLORS['RESET']}")
+            handler = self.reply_handlers.get(subject)
+            if handler is not None:
+                handler(command_reply_message)
             else:
                 logger.warning(f"Unknown subject in reply: {subject}")
         else:
             logger.warning("No reply message received.")
-        
+
+    def handle_log_message(self, log_message):
+        # Why the line was not shown, for its history record
+        return self.core_log_relay.relay(log_message["level"], log_message["message"])
+
+    def handle_commands_list(self, commands_list):
+        if not startup_timer.has_mark("first commands_list received"):
+            startup_timer.mark("first commands_list received")
+            logger.debug(startup_timer.breakdown())
+
+        commands_hash = content_hash(commands_list)
+        if commands_hash == self.commands_hash:
+            logger.debug("Commands list unchanged")
+            return
+        self.apply_commands_list(commands_list, commands_hash)
+        asyncio.get_running_loop().run_in_executor(None, self.commands_cache.save, commands_list, commands_hash)
+
+    def apply_commands_list(self, commands_list, commands_hash):
+        """Rebuild the help text and the command-name index for a new commands list."""
+        self.help = self.setup_help(commands_list=commands_list)
+        self.command_names = sorted(commands_list)
+        self.commands_hash = commands_hash
+
+    def load_commands_cache(self):
+        commands_list, commands_hash = self.commands_cache.load()
+        if commands_list is not None:
+            self.apply_commands_list(commands_list, commands_hash)
+            startup_timer.mark("commands_list cache loaded")
+
+    def handle_command_reply(self, command_reply_message):
+        self.pager.write(self.renderer.render_command_reply(command_reply_message))
+
+    def handle_command_reply_chunk(self, command_reply_message, first, last):
+        self.handle_command_reply(command_reply_message)
+
+    def complete_commands(self):
+        return self.command_names + self.LOCAL_COMMANDS
+
     async def terminal_listen(self):
+        # Read stdin from the event loop; output goes through a stream that keeps the prompt intact
+        self.line_reader = AsyncLineReader(completer=self.complete_commands)
+        stdout = sys.stdout
+        prompt_stream = PromptAwareStream(stdout, self.line_reader)
+        sys.stdout = prompt_stream
+        console_handler.setStream(prompt_stream)
+        self.renderer.stream = prompt_stream
+        self.pager.line_reader = self.line_reader
+        history_task = asyncio.create_task(self.enableHistory(self.history_path))
+
         # Create asyncio tasks for terminal input
         terminal_task = asyncio.create_task(self.terminal_input_loop())
 
@@ -60,16 +179,23 @@ class TerminalInterpreter:
             logger.critical("Exception: " + str(exc) + ". Exiting.")
         finally:
             self.running = False
+            history_task.cancel()
+            self.gpio_watcher.stop()
+            self.pager.close()
+            self.line_reader.stop()
+            prompt_stream.flush()
+            sys.stdout = stdout
+            console_handler.setStream(stdout)
+            self.renderer.stream = stdout
 
     async def terminal_input_loop(self):
-        # Create an event loop for the stdin reader
-        loop = asyncio.get_event_loop()
-
+        startup_timer.mark("prompt ready")
+        if self.profile_startup:
+            print(startup_timer.breakdown())
         while self.running:
             try:
-                # Use run_in_executor to handle blocking input() in a non-blocking way
-                # Pass the prompt directly to input() so readline can handle it properly
-                user_input = await loop.run_in_executor(None, lambda: input("Enter command: "))
+                user_input = await self.line_reader.readline("Enter command: ")
+                self.pager.reset()
 
                 if user_input:
                     # Split user_input by ";" to handle multiple commands
@@ -81,10 +207,24 @@ class TerminalInterpreter:
                             break
                         elif command.lower() in ["h", "?"]:
                             self.handle_help()
+                        elif command.lower() == "stats":
+                            self.handle_stats()
+                        elif command.lower() == "latency":
+                            self.handle_latency()
+                        elif command.lower() == "queues":
+                            self.handle_queues()
+                        elif command.lower().split()[0] == "watch":
+                            self.handle_watch(command.split()[1:])
+                        elif command.lower().split()[0] == "corelog":
+                            self.handle_corelog(command.split()[1:])
+                        elif command.lower().split()[0] == "history":
+                            self.handle_history(command.split()[1:])
+                        elif command.lower().split()[0] == "fleet":
+                            self.handle_fleet(command.split(maxsplit=1)[1:])
+                        elif self.fleet.active:
+                            await self.fleet.run(command)
                         else:
-                            await self.mqueue_handler.dispatch_message(command, "terminal_command", "core")# TODO: reply_to not working, "terminal")
-                            #TODO: useless
-                            #print(command_reply_message)
+                            await self.mqueue_handler.dispatch_message(command, "terminal_command", "core")
                 else:
                     pass#print("\r")
             except EOFError:
@@ -98,59 +238,121 @@ class TerminalInterpreter:
                 self.running = False
                 break
 
-    def enableHistory(self, historyPath):
-        history_file = os.path.expanduser(historyPath)
-        if os.path.exists(history_file):
-            readline.read_history_file(history_file)
+    async def enableHistory(self, historyPath):
+        # The file is read on a worker thread, but readline is only touched from the event
+        # loop, which also adds the lines typed at the prompt: its history API isn't thread safe
+        saved = await asyncio.get_running_loop().run_in_executor(None, read_history_file, os.path.expanduser(historyPath))
+        # Lines entered while the file was loading go after the saved ones
+        typed = [readline.get_history_item(index) for index in range(1, readline.get_current_history_length() + 1)]
+        readline.clear_history()
+        for line in saved + typed:
+            readline.add_history(line)
+        self.history_loaded = True
 
     def save_history(self, historyPath):
+        # Only write back a history that was loaded, or the saved one would be overwritten;
+        # readline truncates the file to commandHistoryLength lines
+        if not self.history_loaded:
+            return
         history_file = os.path.expanduser(historyPath)
         readline.write_history_file(history_file)
 
     def handle_help(self):
         print(self.help)
 
+    def handle_stats(self):
+        print(metrics.report())
+
+    def handle_latency(self):
+        print(self.mqueue_handler.request_tracker.latency_report())
+
+    def handle_queues(self):
+        print(self.mqueue_handler.mqueue_sender.inbound_dispatcher.queues_report())
+
+    def handle_corelog(self, args):
+        if args:
+            level = get_logging_level_from_name(args[0])
+            if level == "":
+                print(f"{COLORS['RED']}Unknown log level: {args[0]}{COLORS['RESET']}")
+                return
+            self.core_log_relay.set_min_level(level)
+        print(self.core_log_relay.status())
+
+    def handle_history(self, args):
+        """history [tail [N] | grep PATTERN | since TIME [until TIME]] [subject:NAME] [level:LEVEL]"""
+        history = self.mqueue_handler.history
+        filters = {}
+        for arg in [arg for arg in args if arg.partition(":")[0] in ("subject", "level")]:
+            args.remove(arg)
+            name, _, value = arg.partition(":")
+            filters[name] = value
+        action = args[0].lower() if args else "tail"
+        try:
+            if action == "tail":
+                records = history.tail(int(args[1]) if len(args) > 1 else 20, **filters)
+            elif action == "grep" and len(args) > 1:
+                records = history.grep(" ".join(args[1:]), **filters)
+            elif action == "since" and len(args) > 1:
+                end = parse_time(args[3]) if len(args) > 3 and args[2].lower() == "until" else None
+                records = history.since(parse_time(args[1]), end, **filters)
+            else:
+                print(f"{COLORS['RED']}Usage: history [tail [N] | grep PATTERN | since TIME [until TIME]] [subject:NAME] [level:LEVEL]{COLORS['RESET']}")
+                return
+        except (ValueError, re.error) as e:
+            print(f"{COLORS['RED']}Invalid history query: {e}{COLORS['RESET']}")
+            return
+        lines = [record.format() for record in records]
+        lines.append(history.status())
+        self.pager.write("\n".join(lines) + "\n")
+
+    def handle_fleet(self, args):
+        if args and args[0].lower() == "off":
+            self.fleet.set_targets([])
+        elif args:
+            self.fleet.set_targets(parse_core_list(args[0]))
+        print(self.fleet.status())
+
     def handle_show_gpio_status(self, gpio_status):
-        color_red = COLORS["RED"]
-        print(f"{color_red}Current GPIO Status:")
-        for gpio_info in gpio_status:
-            gpio = gpio_info["pin"]
-            label = gpio_info["label"]
-            mode = gpio_info["mode"]
-            state = gpio_info["state"]
-            switchstate = gpio_info["switch"]
-
-            color = COLORS["RESET"]
-            switchcolor = COLORS["RESET"]
-
-            if mode == "INPUT":
-                color = COLORS["BLUE"]
-            elif mode == "OUTPUT":
-                color = COLORS["RESET"]
-
-            if state == "HIGH":
-                switchcolor = COLORS["MAGENTA"]
-            elif state == "LOW":
-                switchcolor = COLORS["GREEN"]
-
-            if state == "ERROR":
-                color = COLORS["RED"]
-                switchcolor = color
-
-            print(
-                f"{color}Pin {gpio} label: {label} \
-mode: {mode}, state: {state}, switch: {COLORS['RESET']}{switchcolor}{switchstate}{COLORS['RESET']}"
-            )
+        if self.gpio_watcher.active:
+            self.gpio_watcher.render_update(gpio_status)
+        else:
+            self.gpio_watcher.render_full(gpio_status, self.pager.write)
+
+    def handle_gpio_status_chunk(self, gpio_status, first, last):
+        if not self.gpio_watcher.active:
+            self.pager.write(self.renderer.render_gpio_status(gpio_status, title=first))
+            return
+        # Watch mode diffs whole snapshots, so collect the chunks first
+        if first:
+            self.gpio_chunks = []
+        self.gpio_chunks.extend(gpio_status)
+        if last:
+            self.handle_show_gpio_status(self.gpio_chunks)
+            self.gpio_chunks = []
 
-    def handle_show_configuration(self, settings):
+    def handle_watch(self, args):
+        if args and args[0].lower() == "off":
+            self.gpio_watcher.stop()
+            print("GPIO watch stopped")
+            return
+        try:
+            interval = float(args[0]) if args else None
+        except ValueError:
+            print(f"{COLORS['RED']}Invalid watch interval: {args[0]}{COLORS['RESET']}")
+            return
+        try:
+            self.gpio_watcher.start(interval)
+        except ValueError as e:
+            print(f"{COLORS['RED']}{e}{COLORS['RESET']}")
 
-        # Print DunebuggerSettings configuration
-        color_blue = COLORS["BLUE"]
-        color_red = COLORS["RED"]
-        print(f"{color_red}Current Configuration:")
-        for setting in settings:
-            for key, value in setting.items():
-                print(f"{color_blue}{key}: {COLORS['RESET']}{value}")
+    async def request_gpio_status(self):
+        await self.mqueue_handler.dispatch_message("s", "terminal_command", "core")
+
+    def handle_show_configuration(self, configuration):
+        self.pager.write(self.renderer.render_configuration(configuration))
+
+    def handle_configuration_chunk(self, configuration, first, last):
+        self.pager.write(self.renderer.render_configuration(configuration, title=first))
 
     def _log_queue_message(self, level, message):
         """Log messages from the queue with core: prefix and magenta color."""
@@ -170,11 +372,16 @@ mode: {mode}, state: {state}, switch: {COLORS['RESET']}{switchcolor}{switchstate
             logger.critical(prefixed_message)
         else:
             # For unknown levels, use info as fallback
-            logger.info(f"{color_cyan}{level}: core: {message}{color_reset}")
+            logger.info(f"{COLORS['CYAN']}{level}: core: {message}{color_reset}")
 
     async def request_commands_list(self):
         """Request the commands list from the dunebugger core."""
-        await self.mqueue_handler.dispatch_message("get_commands_list", "terminal_command", "core")
+        await self.mqueue_handler.dispatch_message("get_commands_list", "terminal_command", "core", reply_subjects=["commands_list"])
+
+    async def revalidate_commands_list(self, mqueue):
+        """Fetch the commands list once connected; the cached copy is used until it arrives."""
+        await mqueue.wait_until_ready()
+        await self.request_commands_list()
 
     def setup_help(self, commands_list):
         try:
@@ -184,13 +391,24 @@ mode: {mode}, state: {state}, switch: {COLORS['RESET']}{switchcolor}{switchstate
                 help_insert_1 = ""
 
             # Dynamically create the help string
-            terminal_help = f"I am {help_insert_1}a Raspberry. You can ask me to:\n"
-            for command, details in commands_list.items():
-                terminal_help += f"    {command}: {details['description']}\n"
-            terminal_help += "    h, ?: show this help\n"
-            terminal_help += "    s: show GPIO status\n"
-            terminal_help += "    t: show dunebugger configuration\n"
-            terminal_help += "    q, quit, exit: exit the program\n"
+            lines = [f"I am {help_insert_1}a Raspberry. You can ask me to:"]
+            lines.extend(f"    {command}: {details['description']}" for command, details in commands_list.items())
+            lines.extend(
+                [
+                    "    h, ?: show this help",
+                    "    s: show GPIO status",
+                    "    t: show dunebugger configuration",
+                    "    watch [SECONDS|off]: watch GPIO status every SECONDS (at least 0.2, default 1), redrawing only changed pins",
+                    "    stats: show runtime metrics",
+                    "    latency: show command round-trip latency",
+                    "    queues: show inbound queue depths and wait times",
+                    "    corelog [LEVEL]: show core log relay status or set its minimum level",
+                    "    history [tail [N] | grep PATTERN | since TIME [until TIME]] [subject:NAME] [level:LEVEL]: search received messages",
+                    "    fleet [CORES|off]: send the following commands to several cores (IDs or globs, e.g. fleet *)",
+                    "    q, quit, exit: exit the program",
+                ]
+            )
+            terminal_help = "\n".join(lines) + "\n"
 
             return terminal_help
 
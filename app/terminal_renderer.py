@@ -0,0 +1,72 @@
+import sys
+from dunebugger_logging import COLORS
+
+
+class TerminalRenderer:
+    """Builds each reply into one string and writes it with a single call.
+
+    Color prefixes are computed once; color is disabled automatically when the
+    output stream is not a TTY.
+    """
+
+    def __init__(self, stream=None, color=None):
+        self.stream = stream or sys.stdout
+        if color is None:
+            color = self.stream.isatty()
+        self.set_color(color)
+
+    def set_color(self, color):
+        self.color = color
+        self.colors = dict(COLORS) if color else dict.fromkeys(COLORS, "")
+        c = self.colors
+        self.reset = c["RESET"]
+        self.title = c["RED"]
+        self.config_key = c["BLUE"]
+        self.mode_colors = {"INPUT": c["BLUE"], "OUTPUT": c["RESET"]}
+        self.state_colors = {"HIGH": c["MAGENTA"], "LOW": c["GREEN"], "ERROR": c["RED"]}
+        self.level_colors = {"error": c["RED"], "warning": c["YELLOW"]}
+        self.default_level_color = c["MAGENTA"]
+        self.fleet_status_colors = {"ok": c["GREEN"], "failed": c["RED"], "timeout": c["YELLOW"], "no reply": c["YELLOW"]}
+
+    def render_gpio_row(self, gpio_info):
+        mode = gpio_info["mode"]
+        state = gpio_info["state"]
+        if state == "ERROR":
+            color = switchcolor = self.colors["RED"]
+        else:
+            color = self.mode_colors.get(mode, self.reset)
+            switchcolor = self.state_colors.get(state, self.reset)
+        return f"{color}Pin {gpio_info['pin']} label: {gpio_info['label']} mode: {mode}, state: {state}, switch: {self.reset}{switchcolor}{gpio_info['switch']}{self.reset}"
+
+    def render_gpio_status(self, gpio_status, title=True):
+        lines = [f"{self.title}Current GPIO Status:"] if title else []
+        lines.extend(map(self.render_gpio_row, gpio_status))
+        return "\n".join(lines) + "\n"
+
+    def render_configuration(self, configuration, title=True):
+        key_color = self.config_key
+        reset = self.reset
+        lines = [f"{self.title}Current Configuration:"] if title else []
+        for setting in configuration:
+            lines.extend(f"{key_color}{key}: {reset}{value}" for key, value in setting.items())
+        return "\n".join(lines) + "\n"
+
+    def render_command_reply(self, command_reply_message):
+        if command_reply_message["success"] is True:
+            return f"{command_reply_message['message']}\n"
+        color = self.level_colors.get(command_reply_message["level"].lower(), self.default_level_color)
+        return f"{color}{command_reply_message['message']}{self.reset}\n"
+
+    def render_fleet_table(self, command, rows, elapsed):
+        """Render (core, status, latency, message) rows of a fleet command as one table."""
+        width = max([len("core")] + [len(core) for core, _, _, _ in rows])
+        lines = [f"{self.title}'{command}' on {len(rows)} cores in {elapsed * 1000:.0f} ms:{self.reset}", f"{'core':<{width}}  {'status':<9}{'ms':>9}  message"]
+        for core, status, latency, message in rows:
+            color = self.fleet_status_colors.get(status, self.reset)
+            latency = f"{latency * 1000:.1f}" if latency is not None else "-"
+            lines.append(f"{core:<{width}}  {color}{status:<9}{self.reset}{latency:>9}  {message}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
@@ -1,5 +1,8 @@
+import asyncio
 import os
+import random
 import subprocess
+from functools import lru_cache
 from dunebugger_logging import logger
 
 def is_raspberry_pi():
@@ -18,3 +21,32 @@ def validate_path(path):
         return True
     else:
         return False
+
+
+def positive_int(text):
+    """int(text), raising ValueError unless it is at least 1."""
+    value = int(text)
+    if value < 1:
+        raise ValueError(f"must be at least 1, got {value}")
+    return value
+
+
+def backoff_delay(attempt, initial, maximum):
+    """Exponential backoff with jitter: initial * 2**attempt, capped at maximum, times 0.5-1.0."""
+    delay = min(maximum, initial * (2**attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def wait_for_event(event, timeout=None):
+    """Wait until event is set. Returns False if timeout (seconds) expires first."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+@lru_cache(maxsize=256)
+def parse_subject(subject):
+    """Return the message type from a '<root>.<client_id>.<type>' subject."""
+    return subject.split(".")[2]
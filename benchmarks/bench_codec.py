@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Bytes on the wire and encode/decode time of each payload codec.
+
+Encodes typical core traffic (a log message, a command reply, a GPIO status
+list and a large configuration) with PayloadCodec as negotiated with a core
+accepting each codec, and decodes it back with payload_codec.decode. Bytes
+include the NATS header block of a message after the first one to the core
+(the first also carries the accept header). msgpack rows are shown only when
+msgpack is installed.
+
+    python benchmarks/bench_codec.py [--repeat N]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import json_backend  # noqa: E402
+import payload_codec  # noqa: E402
+from payload_codec import PayloadCodec, FORMATS, COMPRESSION  # noqa: E402
+
+
+def envelope(subject, body):
+    return {"body": body, "subject": subject, "source": "core", "correlation_id": "5f0c3d7e9b2a4c1e8d6f0a3b7c9e1d2f"}
+
+
+def payloads(pins, keys):
+    return {
+        "log_message": envelope("log_message", {"level": "INFO", "message": "sequence step 12 completed, switching relay 4 to HIGH"}),
+        "command_reply": envelope("terminal_command_reply", {"success": True, "level": "info", "message": "ok"}),
+        f"gpio_status ({pins} pins)": envelope("show_gpio_status", [{"pin": p, "label": f"relay_{p}", "mode": "OUTPUT", "state": "HIGH" if p % 2 else "LOW", "switch": "on"} for p in range(pins)]),
+        f"configuration ({keys} keys)": envelope("show_configuration", [{f"option_{k}": f"value_{k}" for k in range(j, j + 100)} for j in range(0, keys, 100)]),
+    }
+
+
+def codecs():
+    """One PayloadCodec per codec, negotiated as if the core accepted exactly that codec."""
+    result = {}
+    for name in FORMATS:
+        for compression in ("", COMPRESSION):
+            codec = PayloadCodec(preferred=name, compress_threshold=1024 if compression else 0)
+            codec.accepted["core"] = frozenset(filter(None, ["json", name, compression]))
+            result[f"{name}+{compression}" if compression else name] = codec
+    return result
+
+
+def header_bytes(headers):
+    """Size of the NATS header block: version line, 'name: value' lines and a blank line."""
+    if not headers:
+        return 0
+    return len("NATS/1.0\r\n") + sum(len(f"{name}: {value}\r\n") for name, value in headers.items()) + len("\r\n")
+
+
+def timed(function, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main(repeat, pins, keys):
+    logging.getLogger("dunebuggerLog").setLevel(logging.CRITICAL)
+    print(f"JSON backend: {json_backend.BACKEND}, msgpack: {'installed' if 'msgpack' in FORMATS else 'not installed'}, repeat: {repeat}")
+    first_headers = PayloadCodec().encode({}, "core")[1]
+    print(f"The first message to each core also carries the accept header: +{header_bytes(first_headers)} bytes")
+    print(f"{'payload':<28}{'core accepts':<14}{'sent as':<14}{'bytes':>10}{'ratio':>8}{'encode us':>12}{'decode us':>12}")
+    for label, message in payloads(pins, keys).items():
+        baseline = None
+        for name, codec in codecs().items():
+            (payload, headers), encode_time = timed(codec.encode, repeat, message, "core")
+            decoded, decode_time = timed(payload_codec.decode, repeat, payload, headers)
+            assert decoded == message, f"{name} round trip changed the {label} payload"
+            size = len(payload) + header_bytes(headers)
+            baseline = baseline or size
+            wire_codec = (headers or {}).get(payload_codec.CODEC_HEADER, "json")
+            print(f"{label:<28}{name:<14}{wire_codec:<14}{size:>10,}{size / baseline:>8.2f}{encode_time * 1e6:>12.1f}{decode_time * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--pins", type=int, default=1000)
+    parser.add_argument("--keys", type=int, default=10000)
+    args = parser.parse_args()
+    main(args.repeat, args.pins, args.keys)
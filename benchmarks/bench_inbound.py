@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Microbenchmark of the inbound hot path: decode + subject parsing + dispatch.
+
+Compares the original path (bytes.decode, json.loads, subject.split and an
+if/elif chain) with MessagingQueueHandler.process_mqueue_message using the
+dispatch table, cached subject parsing and the selected JSON backend.
+
+    python benchmarks/bench_inbound.py [--messages N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import json_backend  # noqa: E402
+from mqueue_handler import MessagingQueueHandler  # noqa: E402
+from terminal_interpreter import TerminalInterpreter  # noqa: E402
+
+
+class Message:
+    __slots__ = ("subject", "data", "reply")
+
+    def __init__(self, subject, data):
+        self.subject = subject
+        self.data = data
+        self.reply = ""
+
+
+def make_traffic(count):
+    """Mixed core traffic: mostly log floods, some replies and unhandled subjects."""
+    log = json.dumps({"body": {"level": "INFO", "message": "sequence step 12 completed, switching relay 4 to HIGH"}, "subject": "log_message", "source": "core"}).encode()
+    reply = json.dumps({"body": {"success": True, "level": "info", "message": "ok"}, "subject": "terminal_command_reply", "source": "core"}).encode()
+    heartbeat = json.dumps({"body": {"uptime": 123456, "load": [0.1, 0.2, 0.3]}, "subject": "heartbeat", "source": "core"}).encode()
+    traffic = []
+    for i in range(count):
+        if i % 10 == 0:
+            traffic.append(Message("dunebugger.terminal.terminal_command_reply", reply))
+        elif i % 10 == 1:
+            traffic.append(Message("dunebugger.terminal.heartbeat", heartbeat))
+        else:
+            traffic.append(Message("dunebugger.terminal.log_message", log))
+    return traffic
+
+
+def noop(_body):
+    pass
+
+
+async def legacy_process(mqueue_message):
+    """The pre-dispatch-table path, with the same no-op handlers."""
+    try:
+        data = mqueue_message.data.decode()
+        message_json = json.loads(data)
+    except (AttributeError, UnicodeDecodeError, json.JSONDecodeError):
+        return
+    subject = (mqueue_message.subject).split(".")[2]
+    reply = message_json["body"]
+    if reply:
+        if subject == "show_gpio_status":
+            noop(reply)
+        elif subject == "show_configuration":
+            noop(reply)
+        elif subject == "log_message":
+            noop(reply)
+        elif subject == "commands_list":
+            noop(reply)
+        elif subject == "terminal_command_reply":
+            noop(reply)
+
+
+async def run(process, traffic):
+    start = time.perf_counter()
+    for message in traffic:
+        await process(message)
+    return len(traffic) / (time.perf_counter() - start)
+
+
+async def main(count):
+    logging.getLogger("dunebuggerLog").setLevel(logging.CRITICAL)
+
+    handler = MessagingQueueHandler()
+    interpreter = TerminalInterpreter(handler)
+    for subject in list(interpreter.reply_handlers):
+        interpreter.register_reply_handler(subject, noop)
+    handler.terminal_interpreter = interpreter
+
+    traffic = make_traffic(count)
+    # warm up both paths
+    await run(legacy_process, traffic[:1000])
+    await run(handler.process_mqueue_message, traffic[:1000])
+
+    legacy = await run(legacy_process, traffic)
+    current = await run(handler.process_mqueue_message, traffic)
+    print(f"messages: {count}, JSON backend: {json_backend.BACKEND}")
+    print(f"legacy path:  {legacy:12,.0f} msgs/sec")
+    print(f"current path: {current:12,.0f} msgs/sec  ({current / legacy:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200000)
+    asyncio.run(main(parser.parse_args().messages))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of the inbound pipeline against an in-process NATS stand-in.
+
+The components are built by class_factory with a 'loopback://' server, so
+NATSComm talks to LoopbackNATS instead of a real nats-server. Synthetic core
+traffic (log floods, large GPIO status lists, big configurations, command
+replies) is delivered through the real subscription, InboundDispatcher,
+MessagingQueueHandler.process_mqueue_message and
+TerminalInterpreter.terminal_handle_reply. Terminal output is discarded.
+
+    python benchmarks/bench_pipeline.py [--scale N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from dunebugger_settings import settings  # noqa: E402
+
+settings.mQueueServers = "loopback://benchmark"
+
+import class_factory  # noqa: E402
+from loopback_nats import LoopbackMsg  # noqa: E402
+from request_tracker import LatencyStats  # noqa: E402
+
+SUBJECT_PREFIX = f"{settings.mQueueSubjectRoot}.{settings.mQueueClientID}"
+
+
+class StageTimer:
+    """Wraps an async callable and records how long each call takes."""
+
+    def __init__(self, function):
+        self.function = function
+        self.stats = LatencyStats(window=100000)
+        self.calls = 0
+        self.target = 0
+        self.reached = asyncio.Event()
+
+    async def __call__(self, *args):
+        start = time.perf_counter()
+        try:
+            return await self.function(*args)
+        finally:
+            self.stats.add(time.perf_counter() - start)
+            self.calls += 1
+            if self.calls >= self.target:
+                self.reached.set()
+
+    async def wait_calls(self, target, timeout=60):
+        self.target = target
+        if self.calls < target:
+            self.reached.clear()
+            await asyncio.wait_for(self.reached.wait(), timeout)
+
+
+def encode(subject, body, **envelope):
+    return LoopbackMsg(f"{SUBJECT_PREFIX}.{subject}", json.dumps({"body": body, "subject": subject, "source": "core", **envelope}).encode())
+
+
+def log_flood(count):
+    levels = ["DEBUG", "INFO", "WARNING", "INFO"]
+    return [encode("log_message", {"level": levels[i % 4], "message": f"sequence step {i} completed"}) for i in range(count)]
+
+
+def gpio_status(count, pins=1000):
+    return [encode("show_gpio_status", [{"pin": p, "label": f"relay_{p}", "mode": "OUTPUT", "state": "HIGH" if (p + i) % 2 else "LOW", "switch": "on"} for p in range(pins)]) for i in range(count)]
+
+
+def configuration(count, keys=10000):
+    body = [{f"option_{k}": f"value_{k}" for k in range(j, j + 100)} for j in range(0, keys, 100)]
+    return [encode("show_configuration", body) for _ in range(count)]
+
+
+async def run_traffic(nc, processor, messages, chunk=100):
+    """Deliver messages in chunks, letting the pipeline keep up with each chunk."""
+    target = processor.calls
+    for start in range(0, len(messages), chunk):
+        for msg in messages[start : start + chunk]:
+            nc.deliver(msg)
+        target += len(messages[start : start + chunk])
+        await processor.wait_calls(target)
+
+
+async def run_commands(count, window=16):
+    handler = class_factory.mqueue_handler
+    semaphore = asyncio.Semaphore(window)
+
+    async def one(i):
+        async with semaphore:
+            future = await handler.dispatch_message(f"bench {i}", "terminal_command", "core")
+            await future
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+
+
+def simulated_core(nc):
+    def on_publish(msg):
+        if msg.subject.endswith(".terminal_command"):
+            request = json.loads(msg.data)
+            nc.deliver(encode("terminal_command_reply", {"success": True, "level": "info", "message": "ok"}, correlation_id=request["correlation_id"]))
+
+    return on_publish
+
+
+async def main(scale):
+    devnull = open(os.devnull, "w")
+    logging.getLogger("dunebuggerLog").handlers[0].setStream(devnull)
+    logging.getLogger().handlers[0].setStream(devnull)
+
+    mqueue = class_factory.mqueue
+    interpreter = class_factory.terminal_interpreter
+    interpreter.renderer.stream = devnull
+    handler = class_factory.mqueue_handler
+
+    processor = StageTimer(handler.process_mqueue_message)
+    handler.process_mqueue_message = processor
+    replies = StageTimer(interpreter.terminal_handle_reply)
+    interpreter.terminal_handle_reply = replies
+
+    await mqueue.start_listener()
+    await mqueue.wait_until_ready(5)
+    nc = mqueue.nc
+    nc.on_publish = simulated_core(nc)
+
+    flood, status, config = log_flood(20000 * scale), gpio_status(20 * scale), configuration(5 * scale)
+    scenarios = [
+        ("log flood", lambda: run_traffic(nc, processor, flood), len(flood)),
+        ("gpio status 1k pins", lambda: run_traffic(nc, processor, status, chunk=5), len(status)),
+        ("configuration 10k keys", lambda: run_traffic(nc, processor, config, chunk=1), len(config)),
+        ("command round trips", lambda: run_commands(2000 * scale), 2000 * scale),
+    ]
+
+    print(f"{'scenario':<24}{'msgs':>8}{'msgs/sec':>12}{'decode p50/p95 ms':>20}{'handler p50/p95 ms':>21}{'round trip p95 ms':>19}{'peak MiB':>10}")
+    for name, run, count in scenarios:
+        processor.stats = LatencyStats(window=100000)
+        replies.stats = LatencyStats(window=100000)
+        handler.request_tracker.total = LatencyStats(window=100000)
+
+        start = time.perf_counter()
+        await run()
+        elapsed = time.perf_counter() - start
+        total = processor.stats.summary()
+        handling = replies.stats.summary()
+        round_trip = handler.request_tracker.total.summary()["p95"] * 1000
+
+        # Second pass under tracemalloc, which would skew the timings of the first
+        tracemalloc.start()
+        await run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        decode_p50 = max(0.0, total["p50"] - handling["p50"]) * 1000
+        decode_p95 = max(0.0, total["p95"] - handling["p95"]) * 1000
+        print(f"{name:<24}{count:>8}{count / elapsed:>12,.0f}{decode_p50:>10.3f}/{decode_p95:<9.3f}{handling['p50'] * 1000:>11.3f}/{handling['p95'] * 1000:<9.3f}{round_trip:>19.2f}{peak / 2**20:>10.1f}")
+
+    print()
+    print(class_factory.mqueue.inbound_dispatcher.queues_report())
+    await mqueue.close_listener()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=1, help="multiply the number of messages per scenario")
+    asyncio.run(main(parser.parse_args().scale))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Render-time benchmark of the reply renderers.
+
+Compares the original per-line print() rendering with TerminalRenderer's
+single buffered write for a 1k-pin GPIO status and a 10k-key configuration.
+Output goes to an unbuffered stream on os.devnull so every write is a
+syscall, as on a line-buffered TTY.
+
+    python benchmarks/bench_render.py [--pins N] [--keys N] [--rounds N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from dunebugger_logging import COLORS  # noqa: E402
+from terminal_renderer import TerminalRenderer  # noqa: E402
+
+
+def make_gpio_status(count):
+    modes = ["INPUT", "OUTPUT"]
+    states = ["HIGH", "LOW", "HIGH", "ERROR"]
+    return [{"pin": i, "label": f"relay_{i}", "mode": modes[i % 2], "state": states[i % 4], "switch": "on" if i % 3 else "off"} for i in range(count)]
+
+
+def make_configuration(count):
+    return [{f"option_{i}": f"value_{i}" for i in range(j, min(count, j + 100))} for j in range(0, count, 100)]
+
+
+def legacy_gpio_status(gpio_status):
+    print(f"{COLORS['RED']}Current GPIO Status:")
+    for gpio_info in gpio_status:
+        mode = gpio_info["mode"]
+        state = gpio_info["state"]
+        color = COLORS["RESET"]
+        switchcolor = COLORS["RESET"]
+        if mode == "INPUT":
+            color = COLORS["BLUE"]
+        elif mode == "OUTPUT":
+            color = COLORS["RESET"]
+        if state == "HIGH":
+            switchcolor = COLORS["MAGENTA"]
+        elif state == "LOW":
+            switchcolor = COLORS["GREEN"]
+        if state == "ERROR":
+            color = COLORS["RED"]
+            switchcolor = color
+        print(f"{color}Pin {gpio_info['pin']} label: {gpio_info['label']} mode: {mode}, state: {state}, switch: {COLORS['RESET']}{switchcolor}{gpio_info['switch']}{COLORS['RESET']}")
+
+
+def legacy_configuration(configuration):
+    print(f"{COLORS['RED']}Current Configuration:")
+    for setting in configuration:
+        for key, value in setting.items():
+            print(f"{COLORS['BLUE']}{key}: {COLORS['RESET']}{value}")
+
+
+def timed(function, payload, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(payload)
+    return (time.perf_counter() - start) / rounds
+
+
+def main(pins, keys, rounds):
+    stream = io.TextIOWrapper(open(os.devnull, "wb", buffering=0), write_through=True)
+    renderer = TerminalRenderer(stream, color=True)
+    gpio_status = make_gpio_status(pins)
+    configuration = make_configuration(keys)
+
+    with contextlib.redirect_stdout(stream):
+        results = [
+            (f"gpio status, {pins} pins", timed(legacy_gpio_status, gpio_status, rounds), timed(lambda p: renderer.write(renderer.render_gpio_status(p)), gpio_status, rounds)),
+            (f"configuration, {keys} keys", timed(legacy_configuration, configuration, rounds), timed(lambda p: renderer.write(renderer.render_configuration(p)), configuration, rounds)),
+        ]
+
+    print(f"{'payload':<28}{'print() ms':>12}{'renderer ms':>13}{'speedup':>10}")
+    for name, legacy, current in results:
+        print(f"{name:<28}{legacy * 1000:>12.2f}{current * 1000:>13.2f}{legacy / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pins", type=int, default=1000)
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    main(args.pins, args.keys, args.rounds)